@@ -1,48 +1,129 @@
-import pandas as pd
+import functools
+import gzip
+import json
+import os
+import threading
+
 import dash
 import dash_core_components as dcc
 import dash_table
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-from corona_package import covid_plot
-from plotly.io import templates
+from dash.dependencies import ClientsideFunction, Input, Output, State
+import flask
+from flask_compress import Compress
+import plotly
+from plotly.utils import PlotlyJSONEncoder
+from corona_package import covid_plot, figure_encoding
+from corona_package.data_store import CountryIndex, DataStore, build_summary, listed_countries
+from corona_package.disk_cache import DiskCache, code_token
+from corona_package.figure_cache import FigureCache, figure_key
+from corona_package.figure_encoding import compact_figure
+from corona_package.http_cache import enable_http_caching
+from corona_package.summary_table import SummaryTable
 import dash_table.FormatTemplate as FormatTemplate
 from dash_table.Format import Format, Scheme, Sign, Symbol
 
-# Read and data and create a summary dataframe to be used in dash table
-data = pd.read_csv('./data/processed_data.csv')
-data.population = data.population.fillna(0).map(int)
-last_update = data.date.max()
-summary_df = pd.DataFrame(columns=['Rank',
-                                   'Country / Continent',
-                                   'Continent',
-                                   'Population',
-                                   'Date of first case',
-                                   'Date of first death',
-                                   'Total cases',
-                                   'Total deaths',
-                                   'Deaths per million',
-                                   'Deaths to cases'])\
-    .set_index([
-        'Country / Continent', 
-        'Continent'])
-
-summary_df['Population'] = data.groupby(['country', 'continent'])\
-    .population.max()
-summary_df['Date of first case'] = data.groupby(['country', 'continent'])\
-    .date.min()
-summary_df['Date of first death'] = data[data.deaths > 0].groupby(['country', 'continent'])\
-    .date.min()
-summary_df['Total cases'] = data.groupby(['country', 'continent']).confirmed.max()
-summary_df['Total deaths'] = data.groupby(['country', 'continent']).deaths.max()
-summary_df['Deaths per million'] = summary_df['Total deaths'] / summary_df['Population'] * 1000000
-summary_df['Deaths to cases'] = summary_df['Total deaths'] / summary_df['Total cases']
-
-summary_df = summary_df.sort_values('Total cases', ascending=False).reset_index()
-summary_df['Rank'] = summary_df.index + 1
-summary_df = summary_df.rename(columns={'country': 'Country / Continent',
-                                        'continent': 'Continent'})
+class Snapshot:
+    # Everything the app derives from a version of the processed data. The
+    # layout only needs the summary, the countries and the date of the last
+    # update, which prepare_data.py stores. The data and the index of the
+    # countries are only needed by the figures, so they are loaded on first
+    # use or by the warm-up of the data store.
+    def __init__(self, version, load_data, summary_records, last_update, countries):
+        self.version = version
+        self.load_data = load_data
+        self.summary_table = SummaryTable(summary_records)
+        self.last_update = last_update
+        # Setting options for dropdowns
+        self.country_options = [{'label': c, 'value': c} for c in countries]
+        self._country_index = None
+        self.lock = threading.Lock()
+        # JSON of the default view and its gzipped bytes, see rendered_layout
+        self.layout_json = None
+        self.layout_gzip = None
+        self.layout_lock = threading.Lock()
+
+    @property
+    def country_index(self):
+        # Index the rows of every country once, so that the plots don't scan
+        # the whole dataset on every callback
+        if self._country_index is None:
+            with self.lock:
+                if self._country_index is None:
+                    self._country_index = CountryIndex(self.load_data())
+        return self._country_index
+
+
+def build_snapshot(version, meta, summary_records, load_data):
+    if meta is not None and summary_records is not None and 'countries' in meta:
+        return Snapshot(version, load_data, summary_records,
+                        meta['last_update'], meta['countries'])
+    # Processed data from before the summary was stored, or the CSV
+    data = load_data()
+    return Snapshot(version, lambda: data,
+                    build_summary(data).to_dict('records'),
+                    data.date.max().strftime('%Y-%m-%d'),
+                    listed_countries(data))
+
+
+def warm_up_default_view(snapshot):
+    # The figures of the default view, and its layout if it is served
+    # pre-rendered. Under gunicorn the master builds them before forking the
+    # workers (see gunicorn.conf.py), which then share them.
+    if STATIC_DEFAULT_VIEW:
+        rendered_layout(snapshot)
+    else:
+        selection_figures(snapshot, None, None)
+
+
+def warm_up_snapshot(snapshot):
+    # Build the index of the countries, then the figures of the default view
+    # and of the countries with the most cases, so that their first visitors
+    # don't wait for them. They go to the disk cache of all the workers.
+    snapshot.country_index
+    warm_up_default_view(snapshot)
+    summary_table = snapshot.summary_table
+    top_countries = summary_table.names[~summary_table.is_continent].tolist()
+    for country in top_countries[:WARM_UP_COUNTRIES]:
+        selection_figures(snapshot, country, None)
+
+
+# Read what the layout needs and build the rest in the background. The store
+# checks the processed data in the background and swaps in a new snapshot
+# whenever prepare_data.py is rerun, so the server doesn't need a restart.
+data_store = DataStore(build_snapshot, warm_up=warm_up_snapshot)
+
+# Figures only change with the processed data, so they are cached per
+# data version and shared between the users of a worker. The threshold
+# figures carry the lines of every country, so the cache is bounded by the
+# size of the figures rather than their number.
+figure_cache = FigureCache(max_bytes=64 * 1024 * 1024)
+# Send the points of the figures as base64 typed arrays. They need plotly.js
+# >= 2.28, which is newer than the one of dash-core-components, so this is
+# off and the points are sent as rounded numbers.
+TYPED_FIGURE_ARRAYS = False
+# Built figures are also written to disk, where the other workers find them.
+# They are kept across restarts, until the data or the code that builds them
+# (the plots, their encoding and the settings of this file) changes.
+disk_cache = DiskCache('./data/figure_cache',
+                       token=code_token([__file__, covid_plot.__file__, figure_encoding.__file__],
+                                        plotly.__version__))
+# Number of countries, by total cases, whose figures are built in advance
+WARM_UP_COUNTRIES = 10
+
+
+def prune_caches(snapshot):
+    # The figures of the new version were built by the warm-up before the
+    # swap, only those of the older versions are removed. The disk cache is
+    # only pruned once the new version is served, as requests (or the old
+    # workers of a gunicorn reload) may still use the previous one, and
+    # their figures are then just not cached.
+    figure_cache.prune(snapshot.version)
+    disk_cache.prune(snapshot.version)
+
+
+data_store.on_swap(prune_caches)
 
 ref_countries = [
     'United States',
@@ -54,20 +135,30 @@ ref_countries = [
     'Germany',
 ]
 
-# Setting options for dropdowns
-country_options = []
-for c in data.country.unique().tolist():
-    country_options.append(
-        {
-            'label': c,
-            'value': c
-        })
+# Rows per page of the summary table. The table is paged and sorted on the
+# server, so only the visible page is sent to the browser.
+TABLE_PAGE_SIZE = 20
 
+# Serve the layout of the default view (no selection) with its figures and
+# first table page already in it, rendered once per data version. The page
+# then loads without any callback request, the callbacks only run once the
+# user changes a selection.
+STATIC_DEFAULT_VIEW = True
 
-def build_table(table_data):
+# Filter, sort and page the summary table in the browser, from a copy of the
+# summary sent once with the layout (assets/summary_table.js), instead of a
+# request to update_table on every change of the filters
+CLIENTSIDE_TABLE = True
+
+
+def build_table(summary_table):
+    # The first page of the unfiltered table, later pages come from update_table
+    table_data, page_count = summary_table.page(
+        0, TABLE_PAGE_SIZE, None, None, [0, 1],
+        ['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America'], 1)
     d_table = dash_table.DataTable(
         id='summary_table',
-        data=table_data.to_dict('records'),
+        data=table_data,
         columns=[
             {'name': 'Rank', 'id': 'Rank', 'type': 'numeric'},
             {'name': 'Country / Continent', 'id': 'Country / Continent', 'type': 'text'},
@@ -84,7 +175,12 @@ def build_table(table_data):
             {'name': 'Deaths to cases', 'id': 'Deaths to cases', 'type': 'numeric',
              'format': FormatTemplate.percentage(1)}
             ],
-        sort_action='native',
+        page_action='custom',
+        page_current=0,
+        page_size=TABLE_PAGE_SIZE,
+        page_count=page_count,
+        sort_action='custom',
+        sort_mode='single',
         style_header={
             'backgroundColor': 'rgb(50, 50, 50)',
             'fontWeight': 'bold',
@@ -113,439 +209,509 @@ def build_table(table_data):
         ])
     return d_table
 
-dark_theme = templates['plotly_dark']._compound_props
+@functools.lru_cache(maxsize=None)
+def dark_theme():
+    # Loading the template is slow, it is only needed by the figures
+    from plotly.io import templates
+    return templates['plotly_dark']._compound_props
 
 # Create the app
-app = dash.Dash('Example', external_stylesheets=[dbc.themes.DARKLY])
+# Compression is set up below, after the caching headers
+app = dash.Dash('Example', external_stylesheets=[dbc.themes.DARKLY], compress=False)
 app.css.config.serve_locally = False
 server = app.server
 
+# The asset URLs carry their modification time, so browsers can keep them
+server.config['SEND_FILE_MAX_AGE_DEFAULT'] = 365 * 24 * 3600
+enable_http_caching(server,
+                    current_version=lambda: data_store.current().version,
+                    layout_path=app.config.routes_pathname_prefix + '_dash-layout')
+# gzip the layout, the callback responses and the assets. Flask-Compress 1.4
+# doesn't support brotli.
+server.config.update(
+    COMPRESS_MIMETYPES=['text/html', 'text/css', 'application/json', 'application/javascript'],
+    COMPRESS_LEVEL=6,
+    COMPRESS_MIN_SIZE=1024)
+Compress(server)
+
+
+@server.before_request
+def serve_rendered_layout():
+    # Registered after the caching headers, so a 304 is answered first
+    if not STATIC_DEFAULT_VIEW or flask.request.method != 'GET' or \
+            flask.request.path != app.config.routes_pathname_prefix + '_dash-layout':
+        return None
+    # The layout holds the figures of the default view, a few MB of JSON, so
+    # it is gzipped once per data version instead of by Flask-Compress on
+    # every page load. Flask-Compress leaves encoded responses alone.
+    snapshot = data_store.current()
+    rendered_layout(snapshot)
+    if 'gzip' in flask.request.accept_encodings:
+        response = flask.Response(snapshot.layout_gzip, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = flask.Response(snapshot.layout_json, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@server.route(app.config.routes_pathname_prefix + '_stats')
+def serve_stats():
+    # Hits, misses and evictions of the caches and the time spent filtering
+    # the summary table, for monitoring. Every gunicorn worker has its own,
+    # the disk cache is shared.
+    snapshot = data_store.current()
+    response = flask.jsonify({
+        'pid': os.getpid(),
+        'data_version': snapshot.version,
+        'figure_cache': figure_cache.stats(),
+        'disk_cache': disk_cache.stats(),
+        'summary_table': snapshot.summary_table.stats()
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # Append Boostrap CSS
 # app.css.append_css({'external_url': 'https://codepen.io/amyoshino/pen/jzXypZ.css'})
 
 
-app.layout = html.Div([
-    html.Div([
-        html.H1('COVID-19 Dashboard',
-                className='twelve columns',
-                style={
-                    'margin': 'auto',
-                    'color': 'white',
-                    'textAlign': 'center',
-                    # 'font-size': '55'
-                }
-                )], className='row'),
-    html.Div([
-        html.H4('Last Update: ' + last_update,
+def serve_layout(snapshot=None, figures=None):
+    # Built on every page load, so that a new data version shows up without
+    # restarting the server. figures are the figures of the graphs by id,
+    # the graphs are left empty for update_graphs otherwise.
+    if snapshot is None:
+        # Dash also calls the layout when it is set, to validate it, which
+        # must not start the watcher and the warm-up of the data store in the
+        # importing process (the gunicorn master)
+        snapshot = data_store.current() if flask.has_request_context() else data_store.snapshot
+    figures = figures or {}
+
+    def graph(graph_id):
+        if graph_id in figures:
+            return dcc.Graph(id=graph_id, figure=figures[graph_id])
+        return dcc.Graph(id=graph_id)
+    return html.Div([
+        html.Div([
+            html.H1('COVID-19 Dashboard',
+                    className='twelve columns',
+                    style={
+                        'margin': 'auto',
+                        'color': 'white',
+                        'textAlign': 'center',
+                        # 'font-size': '55'
+                    }
+                    )], className='row'),
+        html.Div([
+            html.H4('Last Update: ' + snapshot.last_update,
+                    className='twelve columns',
+                    style={
+                        'margin': 'auto',
+                        'color': 'white',
+                        'textAlign': 'center',
+                    }
+                    )], className='row'),
+        html.Div([
+            dcc.Markdown(
+                """
+                The unprocessed data for this dashboard were taken from [here](https://github.com/CSSEGISandData/COVID-19).\n
+                The code for the data preparation and the app can be found [here](https://github.com/Vnikas/corona_dash).
+                """,
                 className='twelve columns',
                 style={
                     'margin': 'auto',
-                    'color': 'white',
-                    'textAlign': 'center',
-                }
+                    'margin-bottom': 0,
+                    'color': 'lightgrey',
+                    'textAlign': 'center'
+                    }
                 )], className='row'),
-    html.Div([
-        dcc.Markdown(
-            """
-            The unprocessed data for this dashboard were taken from [here](https://github.com/CSSEGISandData/COVID-19).\n
-            The code for the data preparation and the app can be found [here](https://github.com/Vnikas/corona_dash).
-            """,
-            className='twelve columns',
-            style={
-                'margin': 'auto',
-                'margin-bottom': 0,
-                'color': 'lightgrey',
-                'textAlign': 'center'
-                }
-            )], className='row'),
-    html.Div([
-        html.Div(
-            id='drop_single', children=[
-                dcc.Dropdown(
-                    id='country_dropdown',
-                    options=country_options,
-                    placeholder='Select Country / Continent...',
-                    searchable=True,
-                    style={'background-color': '#303030',
-                           # 'height': '50px',
-                           'width': '100%',
-                           'color': 'white',
-                           # 'font-size': '150%',
-                           'font-color': 'white',
-                           'margin': '0 auto'})
-            ],
-            className='six columns',
-            style={'margin-bottom': '10px',
-                   'margin-left': 'auto',
-                   'margin-right': 'auto',
-                   'margin-top': '10px',
-                   'width': 800}
-        )],
-        className='row'),
-    html.Div([
-        html.Div(
-            id='drop_multi', children=[
-                dcc.Dropdown(
-                    id='reference_dropdown',
-                    options=country_options,
-                    placeholder='Select Reference Countries / Continents...',
-                    multi=True,
-                    searchable=True,
-                    style={'background-color': '#303030',
-                           # 'height': '50px',
-                           'width': '100%',
-                           'color': 'white',
-                           # 'font-size': '150%',
-                           'font-color': 'white',
-                           'margin': '0 auto'})
+        html.Div([
+            html.Div(
+                id='drop_single', children=[
+                    dcc.Dropdown(
+                        id='country_dropdown',
+                        options=snapshot.country_options,
+                        placeholder='Select Country / Continent...',
+                        searchable=True,
+                        style={'background-color': '#303030',
+                               # 'height': '50px',
+                               'width': '100%',
+                               'color': 'white',
+                               # 'font-size': '150%',
+                               'font-color': 'white',
+                               'margin': '0 auto'})
                 ],
-            className='six columns',
-            style={'margin-bottom': '10px',
-                   'margin-left': 'auto',
-                   'margin-right': 'auto',
-                   'margin-top': '10px',
-                   'width': 800}
-        )],
-        className='row'),
-    html.Div([
+                className='six columns',
+                style={'margin-bottom': '10px',
+                       'margin-left': 'auto',
+                       'margin-right': 'auto',
+                       'margin-top': '10px',
+                       'width': 800}
+            )],
+            className='row'),
         html.Div([
-            html.Br(),
-            build_table(summary_df),
-            html.Br()
-            ],
-            className='12 columns', style={'width': 1600, 'margin': '0 auto'})],
-        className='row'),
-    html.Div([
-        html.Div(
-            children=[
-            dbc.Label('Filter table\'s countries based on population or continent',
-                style={'margin-left': 10}),
-            dcc.RangeSlider(
-                id='slider',
-                min=0,
-                max=1,
-                value=[0, 1],
-                step=.25,
-                marks={
-                    0: {'label': '0'},
-                    .25: {'label': '1,4M (Q1)'},
-                    .50: {'label': '8M (Median)'},
-                    .75: {'label': '28M (Q3)'},
-                    1: {'label': '1,5B'}
-                }
-            ),
-            dbc.RadioItems(
-                id='countries_only_checkbox',
-                options=[
-                    {'label': 'Show all', 'value': 1},
-                    {'label': 'Show Countries only', 'value': 2},
-                    {'label': 'Show Continents only', 'value': 3}
-                    ],
-                value=1,
-                inline=True,
-                style={
-                    'text-align': 'center',
-                    'margin-bottom': 10,
-                    'margin-top': 10
-                    },
-                #switch=True,
-                ),  
-            dbc.Checklist(
-                id='checkbox',
-                options=[
-                    {'label': 'Africa', 'value': 'Africa'},
-                    {'label': 'Asia', 'value': 'Asia'},
-                    {'label': 'Europe', 'value': 'Europe'},
-                    {'label': 'North America', 'value': 'North America'},
-                    {'label': 'Oceania', 'value': 'Oceania'},
-                    {'label': 'South America', 'value': 'South America'}
+            html.Div(
+                id='drop_multi', children=[
+                    dcc.Dropdown(
+                        id='reference_dropdown',
+                        options=snapshot.country_options,
+                        placeholder='Select Reference Countries / Continents...',
+                        multi=True,
+                        searchable=True,
+                        style={'background-color': '#303030',
+                               # 'height': '50px',
+                               'width': '100%',
+                               'color': 'white',
+                               # 'font-size': '150%',
+                               'font-color': 'white',
+                               'margin': '0 auto'})
                     ],
-                value=['Africa', 'Asia', 'Europe', 'North America',
-                    'Oceania', 'South America'],
-                inline=True,
-                style={
-                    'text-align': 'center',
-                    'margin-bottom': 10
-                    },
-                switch=True,
-                )  
-            ],
-            className='12 columns', style={
-                'width': 800, 
-                'margin': '0 auto', 
-                'border': '1px lightgrey solid',
-                'margin-bottom': 20}
-                ),
-         ],
-        className='row'),
-    html.Div([
+                className='six columns',
+                style={'margin-bottom': '10px',
+                       'margin-left': 'auto',
+                       'margin-right': 'auto',
+                       'margin-top': '10px',
+                       'width': 800}
+            )],
+            className='row'),
         html.Div([
-            dcc.Graph(
-                id='cases_evolution'
-            )
-            ],
-            className='six columns',
-            style={
-                'margin': '0 auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            }
-        ),
+            html.Div([
+                html.Br(),
+                build_table(snapshot.summary_table),
+                html.Br()
+                ] + ([dcc.Store(id='summary_store', data=snapshot.summary_table.client_data())]
+                     if CLIENTSIDE_TABLE else []),
+                className='12 columns', style={'width': 1600, 'margin': '0 auto'})],
+            className='row'),
         html.Div([
-            dcc.Graph(
-                id='deaths_evolution',
-            )
-            ],
-            className='six columns',
-            style={
-                'margin': '0 auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            }
-        )
-        ], className='row'),
-    html.Div([
-        html.Div([
-            dcc.Graph(
-                id='trajectory_cases'
-            )
-            ],
-            className='six columns',
-            style={
-                'margin': 'auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            }
-        ),
+            html.Div(
+                children=[
+                dbc.Label('Filter table\'s countries based on population or continent',
+                    style={'margin-left': 10}),
+                dcc.RangeSlider(
+                    id='slider',
+                    min=0,
+                    max=1,
+                    value=[0, 1],
+                    step=.25,
+                    marks={
+                        0: {'label': '0'},
+                        .25: {'label': '1,4M (Q1)'},
+                        .50: {'label': '8M (Median)'},
+                        .75: {'label': '28M (Q3)'},
+                        1: {'label': '1,5B'}
+                    }
+                ),
+                dbc.RadioItems(
+                    id='countries_only_checkbox',
+                    options=[
+                        {'label': 'Show all', 'value': 1},
+                        {'label': 'Show Countries only', 'value': 2},
+                        {'label': 'Show Continents only', 'value': 3}
+                        ],
+                    value=1,
+                    inline=True,
+                    style={
+                        'text-align': 'center',
+                        'margin-bottom': 10,
+                        'margin-top': 10
+                        },
+                    #switch=True,
+                    ),  
+                dbc.Checklist(
+                    id='checkbox',
+                    options=[
+                        {'label': 'Africa', 'value': 'Africa'},
+                        {'label': 'Asia', 'value': 'Asia'},
+                        {'label': 'Europe', 'value': 'Europe'},
+                        {'label': 'North America', 'value': 'North America'},
+                        {'label': 'Oceania', 'value': 'Oceania'},
+                        {'label': 'South America', 'value': 'South America'}
+                        ],
+                    value=['Africa', 'Asia', 'Europe', 'North America',
+                        'Oceania', 'South America'],
+                    inline=True,
+                    style={
+                        'text-align': 'center',
+                        'margin-bottom': 10
+                        },
+                    switch=True,
+                    )  
+                ],
+                className='12 columns', style={
+                    'width': 800, 
+                    'margin': '0 auto', 
+                    'border': '1px lightgrey solid',
+                    'margin-bottom': 20}
+                    ),
+             ],
+            className='row'),
         html.Div([
-            dcc.Graph(
-                id='trajectory_deaths'
+            html.Div([
+                graph('cases_evolution')
+                ],
+                className='six columns',
+                style={
+                    'margin': '0 auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                }
+            ),
+            html.Div([
+                graph('deaths_evolution')
+                ],
+                className='six columns',
+                style={
+                    'margin': '0 auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                }
             )
-            ],
-            className='six columns',
-            style={
-                'margin': 'auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            }
-        )
-        ], className='row'),
-    html.Div([
+            ], className='row'),
         html.Div([
-            dcc.Graph(
-                id='deaths_growth'
+            html.Div([
+                graph('trajectory_cases')
+                ],
+                className='six columns',
+                style={
+                    'margin': 'auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                }
+            ),
+            html.Div([
+                graph('trajectory_deaths')
+                ],
+                className='six columns',
+                style={
+                    'margin': 'auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                }
             )
-            ],
-            className='six columns',
-            style={
-                'margin': 'auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            }
-        ),
+            ], className='row'),
         html.Div([
-            dcc.Graph(
-                id='deaths_rate'
+            html.Div([
+                graph('deaths_growth')
+                ],
+                className='six columns',
+                style={
+                    'margin': 'auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                }
+            ),
+            html.Div([
+                graph('deaths_rate')
+                ],
+                className='six columns',
+                style={
+                    'margin': 'auto',
+                    'margin-bottom': 20,
+                    'width': '48%',
+                    'border': '1px lightgrey solid'
+                },
+
             )
-            ],
-            className='six columns',
-            style={
-                'margin': 'auto',
-                'margin-bottom': 20,
-                'width': '48%',
-                'border': '1px lightgrey solid'
-            },
-
-        )
-        ], className='row')
-    ])
+            ], className='row')
+        ])
+
+
+app.layout = serve_layout
+
+# Ids of the graphs, in the order of the outputs of update_graphs
+GRAPH_IDS = ['cases_evolution', 'deaths_evolution', 'trajectory_cases',
+             'trajectory_deaths', 'deaths_growth', 'deaths_rate']
+
+
+def rendered_layout(snapshot):
+    # The layout JSON of the default view, with the figures of no selection,
+    # and its gzipped bytes on the snapshot.
+    # Rendered once per data version (by the warm-up). A request that comes
+    # while it is rendered waits for it instead of building the figures too.
+    if snapshot.layout_json is None:
+        with snapshot.layout_lock:
+            if snapshot.layout_json is None:
+                figures = dict(zip(GRAPH_IDS, selection_figures(snapshot, None, None)))
+                layout_json = json.dumps(serve_layout(snapshot, figures),
+                                         cls=PlotlyJSONEncoder)
+                snapshot.layout_gzip = gzip.compress(
+                    layout_json.encode(), compresslevel=server.config['COMPRESS_LEVEL'])
+                snapshot.layout_json = layout_json
+    return snapshot.layout_json
 
 # Updates
 # Update Table
 
 
-@app.callback(
+TABLE_OUTPUTS = [
     Output(component_id='summary_table', component_property='data'),
-    [Input(component_id='country_dropdown', component_property='value'),
-     Input(component_id='reference_dropdown', component_property='value'),
-     Input(component_id='slider', component_property='value'),
-     Input(component_id='checkbox', component_property='value'),
-     Input(component_id='countries_only_checkbox', component_property='value'),
-     Input(component_id='summary_table', component_property='sort_by')]
-)
+    Output(component_id='summary_table', component_property='page_count')]
+TABLE_INPUTS = [
+    Input(component_id='country_dropdown', component_property='value'),
+    Input(component_id='reference_dropdown', component_property='value'),
+    Input(component_id='slider', component_property='value'),
+    Input(component_id='checkbox', component_property='value'),
+    Input(component_id='countries_only_checkbox', component_property='value'),
+    Input(component_id='summary_table', component_property='sort_by'),
+    Input(component_id='summary_table', component_property='page_current'),
+    Input(component_id='summary_table', component_property='page_size')]
+
+
 def update_table(
         country_value, 
         reference_values, 
         slider_values,
         checkbox_values,
         countries_only,
-        sort_by):
-    # apply population filer
-    continents = data.continent.unique().tolist()
-    world_info = summary_df[summary_df['Country / Continent'] == 'World']
-    from_q = summary_df[(~ summary_df['Country / Continent'].isin(continents)) & 
-        (summary_df.Population > 0)].Population\
-        .quantile(slider_values[0])
-    to_q = summary_df[(summary_df['Country / Continent'] != 'World') & 
-        (summary_df.Population > 0)].Population\
-        .quantile(slider_values[1])
-    summary_df_ = summary_df[(summary_df.Population >= from_q) & 
-        (summary_df.Population <= to_q)]
-    summary_df_ = summary_df_.append(world_info, ignore_index=True)\
-        .sort_values('Total cases', ascending=False).reset_index(drop=True)
-
-    if (country_value is None or len(country_value) < 1) and \
-            (reference_values is None or len(reference_values) < 1):
-        summary_data = summary_df_
-    elif reference_values is None:
-        summary_data = summary_df_[summary_df_['Country / Continent'] == country_value].reset_index(drop=True)
-    elif country_value is None:
-        summary_data = summary_df_[summary_df_['Country / Continent'].isin(reference_values)].reset_index(drop=True)
-    else:
-        summary_countries = [country_value] + reference_values
-        summary_data = summary_df_[summary_df_['Country / Continent'].isin(summary_countries)].reset_index(drop=True) 
-    # apply continent filter
-    summary_data = summary_data[summary_data['Continent'].isin(checkbox_values + ['World'])].reset_index(drop=True)  
-    # apply countries only filter
-    if countries_only == 2:
-        summary_data = summary_data[~ summary_data['Country / Continent'].isin(continents)].reset_index(drop=True)
-    elif countries_only == 3:
-        summary_data = summary_data[summary_data['Country / Continent'].isin(continents)].reset_index(drop=True)
-    if sort_by:
-        summary_data = summary_data.sort_values(
-            sort_by[0]['column_id'],
-            ascending=sort_by[0]['direction'] == 'asc',
-            inplace=False)\
-            .reset_index(drop=True)
-    summary_data['Rank'] = summary_data.index + 1  
-    return summary_data.to_dict('records')
+        sort_by,
+        page_current,
+        page_size):
+    # The filters are applied by the precomputed table of the snapshot, which
+    # returns the current page and the number of pages
+    return data_store.current().summary_table.page(
+        page_current,
+        page_size,
+        country_value,
+        reference_values,
+        slider_values,
+        checkbox_values,
+        countries_only,
+        sort_by)
+
+
+# The first page is in the layout
+if CLIENTSIDE_TABLE:
+    app.clientside_callback(
+        ClientsideFunction(namespace='summary_table', function_name='page'),
+        TABLE_OUTPUTS,
+        TABLE_INPUTS,
+        [State(component_id='summary_store', component_property='data')],
+        prevent_initial_call=STATIC_DEFAULT_VIEW)
+else:
+    app.callback(TABLE_OUTPUTS, TABLE_INPUTS,
+                 prevent_initial_call=STATIC_DEFAULT_VIEW)(update_table)
 
 # Update Plots
 
 
-@app.callback(
-    Output(component_id='cases_evolution', component_property='figure'),
-    [Input(component_id='country_dropdown', component_property='value')]
-)
-def update_graph(value):
-    if value is None:
-        value = 'World'
-    new_fig = covid_plot.plot_metric_evolution_per_country(data, value, 'confirmed')
-    new_fig['layout']['template'] = dark_theme
+def build_evolution_figure(country_index, country_value, reference_values, metric):
+    new_fig = covid_plot.plot_metric_evolution_per_country(country_index, country_value, metric)
+    new_fig['layout']['template'] = dark_theme()
     return new_fig
 
 
-@app.callback(
-    Output(component_id='deaths_evolution', component_property='figure'),
-    [Input(component_id='country_dropdown', component_property='value')]
-)
-def update_graph(value):
-    if value is None:
-        value = 'World'
-    new_fig = covid_plot.plot_metric_evolution_per_country(data, value, 'deaths')
-    new_fig['layout']['template'] = dark_theme
+def build_trajectory_figure(country_index, country_value, reference_values, metric):
+    new_fig = covid_plot.plot_metric_trajectory(
+        country_index=country_index,
+        country=country_value,
+        metric=metric,
+        ref_countries=reference_values or [])
+    new_fig['layout']['template'] = dark_theme()
     return new_fig
 
 
-@app.callback(
-    Output(component_id='trajectory_cases', component_property='figure'),
-    [Input(component_id='country_dropdown', component_property='value'),
-     Input(component_id='reference_dropdown', component_property='value')]
-)
-def update_graph(country_value, reference_values):
-        if country_value is None:
-            country_value = 'World'
-        new_fig = covid_plot.plot_metric_trajectory(
-            data=data, 
-            country=country_value, 
-            metric='confirmed',
-            is_main_country=True)
-        new_fig['layout']['template'] = dark_theme
-        if reference_values is None:
-            return new_fig
-        for ref_country in reference_values:
-            ref_fig = covid_plot.plot_metric_trajectory(
-                data=data, 
-                country=ref_country, 
-                metric='confirmed',
-                is_main_country=False)
-            new_fig['data'] = new_fig['data'] + ref_fig['data']
-        return new_fig
+def build_flat_deaths_figure(country_index, country_value, reference_values, num_deaths):
+    # The default reference countries are shown until the user picks some
+    new_fig = covid_plot.plot_flat_deaths(
+        country_index=country_index,
+        country=country_value,
+        ref_countries=ref_countries if reference_values is None else list(reference_values),
+        num_deaths=num_deaths)
+    new_fig['layout']['template'] = dark_theme()
+    return new_fig
 
 
-@app.callback(
-    Output(component_id='trajectory_deaths', component_property='figure'),
-    [Input(component_id='country_dropdown', component_property='value'),
-     Input(component_id='reference_dropdown', component_property='value')]
-)
-def update_graph(country_value, reference_values):
-    if country_value is None:
-        country_value = 'World'
-    new_fig = covid_plot.plot_metric_trajectory(
-        data=data, 
-        country=country_value, 
-        metric='deaths', 
-        is_main_country=True)
-    new_fig['layout']['template'] = dark_theme
-    if reference_values is None:
-        return new_fig
-    for ref_country in reference_values:
-        ref_fig = covid_plot.plot_metric_trajectory(
-            data=data, 
-            country=ref_country, 
-            metric='deaths',
-            is_main_country=False)
-        new_fig['data'] = new_fig['data'] + ref_fig['data']
+def build_rate_deaths_figure(country_index, country_value, reference_values, death_rate):
+    new_fig = covid_plot.plot_rate_deaths(
+        country_index=country_index,
+        country=country_value,
+        ref_countries=ref_countries if reference_values is None else list(reference_values),
+        death_rate=death_rate)
+    new_fig['layout']['template'] = dark_theme()
     return new_fig
 
-@app.callback(
-    Output(component_id='deaths_growth', component_property='figure'),
-    [Input(component_id='country_dropdown', component_property='value'),
-     Input(component_id='reference_dropdown', component_property='value')]
-)
-def update_graph(country_value, reference_values):
-    if country_value is None:
-        country_value = 'World'
-    new_fig = covid_plot.plot_flat_deaths(data=data,
-                                          country=country_value,
-                                          ref_countries=ref_countries,
-                                          num_deaths=3)
-    new_fig['layout']['template'] = dark_theme
-    if reference_values is None:
-        return new_fig
-    new_fig = covid_plot.plot_flat_deaths(data=data,
-                                          country=country_value,
-                                          ref_countries=reference_values,
-                                          num_deaths=3)
-    new_fig['layout']['template'] = dark_theme
-    return new_fig
 
+def cached_figure(snapshot, plot_name, country_value, reference_values, metric, build_figure):
+    # The figure is built from the normalized key, so that the cached figure
+    # is the same whatever the order of the selected reference countries
+    key = figure_key(plot_name, country_value, reference_values, metric, snapshot.version)
+    _, country_value, reference_values, metric, _ = key
+
+    def load_or_build():
+        # Figures built by another worker (or by the warm-up) are on disk.
+        # Their size for the figure cache is the one of their JSON there.
+        # A figure that another worker is building is waited for, so that
+        # the workers warming up at the same time build every figure once.
+        figure, size = disk_cache.load(key, snapshot.version)
+        if figure is not None:
+            return figure, size
+        locked = disk_cache.claim(key, snapshot.version)
+        if not locked:
+            figure, size = disk_cache.wait(key, snapshot.version)
+            if figure is not None:
+                return figure, size
+        try:
+            figure = compact_figure(
+                build_figure(snapshot.country_index, country_value, reference_values, metric),
+                typed_arrays=TYPED_FIGURE_ARRAYS)
+            size = disk_cache.set(key, snapshot.version, figure)
+        finally:
+            if locked:
+                disk_cache.release(key, snapshot.version)
+        return figure, size
+    return figure_cache.get_or_build(key, load_or_build)
+
+
+def selection_figures(snapshot, country_value, reference_values, evolution=True):
+    # The six figures of a selection, in the order of the outputs of
+    # update_graphs. The evolution figures are left out (None) if not needed.
+    if evolution:
+        evolution_figures = [
+            cached_figure(snapshot, 'evolution', country_value, None, metric,
+                          build_evolution_figure)
+            for metric in ['confirmed', 'deaths']
+        ]
+    else:
+        evolution_figures = [None, None]
+    return evolution_figures + [
+        cached_figure(snapshot, 'trajectory', country_value, reference_values, 'confirmed',
+                      build_trajectory_figure),
+        cached_figure(snapshot, 'trajectory', country_value, reference_values, 'deaths',
+                      build_trajectory_figure),
+        cached_figure(snapshot, 'flat_deaths', country_value, reference_values, 3,
+                      build_flat_deaths_figure),
+        cached_figure(snapshot, 'rate_deaths', country_value, reference_values, 0.1,
+                      build_rate_deaths_figure)
+    ]
+
+
+# All the figures depend on the same dropdowns, so they are updated by a single
+# callback, from a single snapshot and with a single request per selection
 @app.callback(
-    Output(component_id='deaths_rate', component_property='figure'),
+    [Output(component_id='cases_evolution', component_property='figure'),
+     Output(component_id='deaths_evolution', component_property='figure'),
+     Output(component_id='trajectory_cases', component_property='figure'),
+     Output(component_id='trajectory_deaths', component_property='figure'),
+     Output(component_id='deaths_growth', component_property='figure'),
+     Output(component_id='deaths_rate', component_property='figure')],
     [Input(component_id='country_dropdown', component_property='value'),
-     Input(component_id='reference_dropdown', component_property='value')]
+     Input(component_id='reference_dropdown', component_property='value')],
+    # The figures of the default view are in the layout
+    prevent_initial_call=STATIC_DEFAULT_VIEW
 )
-def update_graph(country_value, reference_values):
-    if country_value is None:
-        country_value = 'World'
-    new_fig = covid_plot.plot_rate_deaths(data=data,
-                                          country=country_value,
-                                          ref_countries=ref_countries,
-                                          death_rate=0.1)
-    new_fig['layout']['template'] = dark_theme
-    if reference_values is None:
-        return new_fig
-    new_fig = covid_plot.plot_rate_deaths(data=data,
-                                          country=country_value,
-                                          ref_countries=reference_values,
-                                          death_rate=0.1)
-    new_fig['layout']['template'] = dark_theme
-    return new_fig
+def update_graphs(country_value, reference_values):
+    snapshot = data_store.current()
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    # The evolution figures don't show the reference countries
+    if triggered == ['reference_dropdown.value']:
+        return [dash.no_update, dash.no_update] + \
+            selection_figures(snapshot, country_value, reference_values, evolution=False)[2:]
+    return selection_figures(snapshot, country_value, reference_values)
 
 
 if __name__ == '__main__':
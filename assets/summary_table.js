@@ -0,0 +1,118 @@
+// Clientside version of SummaryTable.page (corona_package/summary_table.py),
+// used by the app when CLIENTSIDE_TABLE is set: the summary is sent once in
+// the summary_store and the table is filtered, sorted and paged in the
+// browser. Must give the same rows as the server side.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    summary_table: (function () {
+        // What only depends on the summary is derived once per store data
+        var cache = {summary: null};
+
+        function isMissing(value) {
+            return value === null || value === undefined ||
+                (typeof value === 'number' && isNaN(value));
+        }
+
+        function derive(summary) {
+            var columns = summary.columns;
+            var names = columns['Country / Continent'];
+            var continentNames = {};
+            columns['Continent'].forEach(function (c) { continentNames[c] = true; });
+            return {
+                summary: summary,
+                columnIds: Object.keys(columns),
+                length: names.length,
+                isWorld: names.map(function (n) { return n === 'World'; }),
+                isContinent: names.map(function (n) { return continentNames[n] === true; }),
+                orders: {}
+            };
+        }
+
+        function sortOrder(table, column, ascending) {
+            // Stable order of the rows by a column, missing values last
+            var key = column + '|' + ascending;
+            if (!table.orders[key]) {
+                var values = table.summary.columns[column];
+                var present = [];
+                var missing = [];
+                values.forEach(function (v, i) { (isMissing(v) ? missing : present).push(i); });
+                present.sort(function (a, b) {
+                    var x = values[a];
+                    var y = values[b];
+                    if (x === y) {
+                        return 0;
+                    }
+                    return (x < y) === ascending ? -1 : 1;
+                });
+                table.orders[key] = present.concat(missing);
+            }
+            return table.orders[key];
+        }
+
+        function quantile(quantiles, stops, q) {
+            var i = stops.indexOf(q);
+            return i < 0 ? null : quantiles[i];
+        }
+
+        function mask(table, countryValue, referenceValues, sliderValues,
+                      checkboxValues, countriesOnly) {
+            // Same filters as SummaryTable.mask
+            var columns = table.summary.columns;
+            var names = columns['Country / Continent'];
+            var fromPopulation = quantile(table.summary.from_quantiles, table.summary.stops, sliderValues[0]);
+            var toPopulation = quantile(table.summary.to_quantiles, table.summary.stops, sliderValues[1]);
+            var selected = null;
+            if ((countryValue === null || countryValue === undefined || countryValue.length < 1) &&
+                    (referenceValues === null || referenceValues === undefined || referenceValues.length < 1)) {
+                selected = null;
+            } else if (referenceValues === null || referenceValues === undefined) {
+                selected = [countryValue];
+            } else if (countryValue === null || countryValue === undefined) {
+                selected = referenceValues;
+            } else {
+                selected = [countryValue].concat(referenceValues);
+            }
+            var continents = checkboxValues.concat(['World']);
+            var keep = [];
+            for (var i = 0; i < table.length; i++) {
+                var population = columns['Population'][i];
+                keep.push(
+                    (table.isWorld[i] || (fromPopulation !== null && toPopulation !== null &&
+                                          population >= fromPopulation && population <= toPopulation)) &&
+                    (selected === null || selected.indexOf(names[i]) >= 0) &&
+                    continents.indexOf(columns['Continent'][i]) >= 0 &&
+                    !(countriesOnly === 2 && table.isContinent[i]) &&
+                    !(countriesOnly === 3 && !table.isContinent[i])
+                );
+            }
+            return keep;
+        }
+
+        return {
+            page: function (countryValue, referenceValues, sliderValues, checkboxValues,
+                            countriesOnly, sortBy, pageCurrent, pageSize, summary) {
+                if (cache.summary !== summary) {
+                    cache = derive(summary);
+                }
+                var table = cache;
+                var keep = mask(table, countryValue, referenceValues, sliderValues,
+                                checkboxValues, countriesOnly);
+                var order;
+                if (sortBy && sortBy.length) {
+                    order = sortOrder(table, sortBy[0].column_id, sortBy[0].direction === 'asc');
+                } else {
+                    order = keep.map(function (_, i) { return i; });
+                }
+                var rows = order.filter(function (i) { return keep[i]; });
+                var pageCount = Math.max(1, Math.ceil(rows.length / pageSize));
+                var first = Math.min(pageCurrent || 0, pageCount - 1) * pageSize;
+                var records = rows.slice(first, first + pageSize).map(function (i, position) {
+                    var record = {};
+                    table.columnIds.forEach(function (c) { record[c] = table.summary.columns[c][i]; });
+                    record['Rank'] = first + position + 1;
+                    return record;
+                });
+                return [records, pageCount];
+            }
+        };
+    })()
+});
@@ -0,0 +1,60 @@
+# Benchmark of the figure builders of the app with and without reference
+# countries, on the processed data in ./data, with the size of the figures
+# sent to the browser. Every country of a figure must be built exactly once,
+# so the run fails if a builder is called more often.
+# Run from the root of the repo:
+# $ python3 -m benchmarks.bench_figures
+import sys
+from collections import Counter
+
+import app
+from benchmarks.bench_read_data import best_time
+from corona_package import covid_plot
+from corona_package.figure_encoding import compact_figure, figure_size
+
+REFERENCES = ['Italy', 'Spain', 'Germany', 'Sweden', 'Turkey']
+FIGURES = [
+    ('trajectory', app.build_trajectory_figure, 'confirmed'),
+    ('flat_deaths', app.build_flat_deaths_figure, 3),
+    ('rate_deaths', app.build_rate_deaths_figure, 0.1),
+]
+
+
+def count_calls(module, name, counter):
+    # Count the calls of a function of covid_plot per country
+    function = getattr(module, name)
+
+    def counted(country_index, country, *args, **kwargs):
+        counter[country] += 1
+        return function(country_index, country, *args, **kwargs)
+    setattr(module, name, counted)
+
+
+if __name__ == '__main__':
+    # Not current(), which starts the background warm-up of the app, whose
+    # figures would be counted with the ones of the benchmark
+    country_index = app.data_store.snapshot.country_index
+    references = [c for c in REFERENCES if c in country_index]
+    country = 'World'
+    calls = Counter()
+    count_calls(covid_plot, 'trajectory_traces', calls)
+    count_calls(covid_plot, 'threshold_data', calls)
+
+    failed = False
+    print('Building figures of', country, 'with', len(references), 'references')
+    for plot_name, build_figure, metric in FIGURES:
+        # The background lines are built once per data version, not per figure
+        build_figure(country_index, country, references, metric)
+        calls.clear()
+        build_figure(country_index, country, references, metric)
+        extra = {c: n for c, n in calls.items() if n > 1}
+        failed = failed or bool(extra) or set(calls) != set(references) | {country}
+        alone = best_time(lambda: build_figure(country_index, country, [], metric), repeat=10)
+        with_references = best_time(lambda: build_figure(country_index, country, references, metric), repeat=10)
+        size = figure_size(compact_figure(build_figure(country_index, country, references, metric)))
+        print('%-12s alone %.1f ms  with references %.1f ms  x%.1f for %d countries  %s  %d KB' % (
+            plot_name, alone * 1000, with_references * 1000, with_references / alone,
+            len(references) + 1, 'built more than once: %s' % extra if extra else 'each built once',
+            size // 1024))
+    if failed:
+        sys.exit(1)
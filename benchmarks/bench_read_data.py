@@ -0,0 +1,28 @@
+# Benchmark of read_data() on the raw reports in ./data/raw_data, with a
+# growing number of worker processes. Run from the root of the repo:
+# $ python3 -m benchmarks.bench_read_data
+import glob
+import os
+import time
+
+from corona_package.prepare_data import RAW_DATA_DIR, read_data
+
+
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    all_files = glob.glob(RAW_DATA_DIR + '/*.csv')
+    cpus = os.cpu_count() or 1
+    print('Reading', len(all_files), 'reports on', cpus, 'CPUs')
+    serial_time = None
+    for workers in sorted({w for w in (1, 2, 4, 8, 16) if w <= cpus} | {cpus}):
+        seconds = best_time(lambda: read_data(all_files, workers=workers))
+        serial_time = serial_time or seconds
+        print('workers=%-3d %.2fs  speedup x%.1f' % (workers, seconds, serial_time / seconds))
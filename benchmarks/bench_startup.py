@@ -0,0 +1,80 @@
+# Benchmark of the cold start of the app: the import time of app.py with the
+# heaviest modules it imports (from python -X importtime), and the time from
+# the start of a fresh process to the first layout and figures responses.
+# Every run is appended to benchmarks/startup_history.csv, to track them.
+# Run from the root of the repo:
+# $ python3 -m benchmarks.bench_startup
+import csv
+import os
+import subprocess
+import sys
+import time
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), 'startup_history.csv')
+
+# Imports the app and requests the layout then all the figures, like a first
+# visitor, printing the seconds since the start of the process
+BOOT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.server.test_client()
+assert client.get('/_dash-layout').status_code == 200
+layout = time.perf_counter()
+snapshot = app.data_store.current()
+for build_figure, metric in [(app.build_evolution_figure, 'confirmed'),
+                             (app.build_trajectory_figure, 'confirmed'),
+                             (app.build_flat_deaths_figure, 3),
+                             (app.build_rate_deaths_figure, 0.1)]:
+    build_figure(snapshot.country_index, 'World', None, metric)
+figures = time.perf_counter()
+print(imported - start, layout - start, figures - start)
+'''
+
+
+def import_times():
+    # Cumulative import time in ms of every module imported by app.py
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+if __name__ == '__main__':
+    times = import_times()
+    heaviest = sorted((name for name in times if '.' not in name and name != 'app'),
+                      key=times.get, reverse=True)[:10]
+    print('Import of app: %.0f ms' % times['app'])
+    for name in heaviest:
+        print('  %-30s %6.0f ms' % (name, times[name]))
+
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', BOOT_SCRIPT],
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    imported, layout, figures = [float(t) * 1000 for t in output.split()[-3:]]
+    print('Import %.0f ms, first layout %.0f ms, first figures %.0f ms' % (imported, layout, figures))
+
+    new_file = not os.path.exists(HISTORY_PATH)
+    with open(HISTORY_PATH, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['time', 'revision', 'import_ms', 'first_layout_ms',
+                             'first_figures_ms', 'importtime_app_ms'])
+        writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), git_revision(),
+                         '%.0f' % imported, '%.0f' % layout, '%.0f' % figures,
+                         '%.0f' % times['app']])
+    print('Appended to', HISTORY_PATH)
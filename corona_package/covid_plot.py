@@ -1,4 +1,16 @@
-def plot_metric_evolution_per_country(data, country, metric):
+import numpy as np
+
+from corona_package.data_store import days_since_column
+from corona_package.figure_encoding import lttb
+
+# Width in pixels of the plots, at most half of a wide screen
+CHART_WIDTH = 960
+# The background lines are thin and smoothed, a point every two pixels is
+# enough to draw them
+BACKGROUND_POINTS = CHART_WIDTH // 2
+
+
+def plot_metric_evolution_per_country(country_index, country, metric):
     if metric == 'confirmed':
         total_metric_text = 'Total Cases'
         new_metric_text = 'New Cases'
@@ -10,46 +22,30 @@ def plot_metric_evolution_per_country(data, country, metric):
     metric_col = metric
     daily_metric_col = 'daily_' + metric
 
-    df_ = data[data.country == country].reset_index(drop=True)
-    df_['total_hovertexts'] = 'Country: ' + \
-                              df_.country + \
-                              '<br>' + \
-                              'Date: ' + \
-                              df_.date + \
-                              '<br>' + \
-                              total_metric_text + \
-                              ': ' + \
-                              df_[metric_col].map(str)
-    df_['new_hovertexts'] = 'Country: ' + \
-                            df_.country + \
-                            '<br>' + \
-                            'Date: ' + \
-                            df_.date + \
-                            '<br>' + \
-                            new_metric_text + \
-                            ': ' + \
-                            df_[daily_metric_col].map(str)
+    df_ = country_index[country]
 
     upper_range = int(df_[daily_metric_col].max() * 1.8)
     fig = {
         'data': [
             {
-                'x': df_.date,
+                'x': df_.date_label,
                 'y': df_[metric_col],
                 'mode': 'markers+lines',
                 'name': total_metric_text,
                 'marker': {'size': 8},
-                'hoverinfo': 'text',
-                'hovertext': df_['total_hovertexts']
+                'hovertemplate': 'Country: ' + country +
+                                 '<br>Date: %{x|%Y-%m-%d}<br>' +
+                                 total_metric_text + ': %{y:,}<extra></extra>'
             },
             {
-                'x': df_.date,
+                'x': df_.date_label,
                 'y': df_[daily_metric_col],
                 'name': new_metric_text,
                 'type': 'bar',
                 'yaxis': 'y2',
-                'hoverinfo': 'text',
-                'hovertext': df_['new_hovertexts'],
+                'hovertemplate': 'Country: ' + country +
+                                 '<br>Date: %{x|%Y-%m-%d}<br>' +
+                                 new_metric_text + ': %{y:,}<extra></extra>',
                 'marker': {
                     'color': 'darkorange'
                 }
@@ -81,36 +77,25 @@ def plot_metric_evolution_per_country(data, country, metric):
     return fig
 
 
-def plot_metric_trajectory(data, country, metric, is_main_country):
+def trajectory_texts(metric):
     if metric == 'confirmed':
-        total_metric_text = 'Total Confirmed Cases'
-        weekly_metric_text = 'Weekly Confirmed Cases'
-        title_text = 'confirmed cases'
-    else:
-        total_metric_text = 'Total Confirmed Deaths'
-        weekly_metric_text = 'New Confirmed Deaths'
-        title_text = 'confirmed deaths'
+        return 'Total Confirmed Cases', 'Weekly Confirmed Cases', 'confirmed cases'
+    return 'Total Confirmed Deaths', 'New Confirmed Deaths', 'confirmed deaths'
+
+
+def trajectory_traces(country_index, country, metric, is_main_country):
+    # The line and the label of a country in the trajectory figure
+    total_metric_text, weekly_metric_text, _ = trajectory_texts(metric)
     metric_col = metric
     weekly_metric_col = 'weekly_' + metric
     daily_metric_col = 'daily_' + metric
 
-    df_ = data[data.country == country].reset_index(drop=True).sort_values('date')
-
-    df_[weekly_metric_col] = df_[daily_metric_col].rolling(7).sum()
-    upper_range = int(df_[metric_col].max() * 2)
-    df_['hovertexts'] = 'Country: ' + \
-                         df_.country + \
-                        '<br>' + \
-                        'Date: ' + \
-                         df_.date + \
-                         '<br>' + \
-                         total_metric_text + \
-                         ': ' + \
-                         df_[metric_col].map(str) + \
-                         '<br>' + \
-                         weekly_metric_text + \
-                         ': ' + \
-                         df_[weekly_metric_col].map(str)
+    df_ = country_index[country]
+    # The weekly sums are computed by prepare_data.py, older processed data
+    # may not have them
+    if weekly_metric_col not in df_:
+        df_ = df_.reset_index(drop=True)
+        df_[weekly_metric_col] = df_[daily_metric_col].rolling(7).sum()
     if is_main_country:
         marker_size = 6
         line_width = 3
@@ -122,37 +107,49 @@ def plot_metric_trajectory(data, country, metric, is_main_country):
         label_line_width = 2
         label_marker_size = 6
 
-
-    fig = {
-        'data': [
-            {
-                'x': df_[metric_col],
-                'y': df_[weekly_metric_col],
-                'mode': 'lines+markers',
-                'marker': {'size': marker_size},
-                'line': {
-                        'width': line_width
-                        },
-                'hoverinfo': 'text',
-                'hovertext': df_['hovertexts']
-            }
-        ] + [
-            {
-                'x': df_[metric_col].tail(1),
-                'y': df_[weekly_metric_col].tail(1),
-                'text': country,
-                'textposition': 'middle right',
-                'mode': 'markers+text',
-                'marker': {
-                    'size': label_marker_size,
-                    'line': {
-                        'width': label_line_width,
-                        'color': 'white',
+    return [
+        {
+            'x': df_[metric_col],
+            'y': df_[weekly_metric_col],
+            'mode': 'lines+markers',
+            'marker': {'size': marker_size},
+            'line': {
+                    'width': line_width
                     },
-                    'color': 'grey'
+            'customdata': df_.date_label,
+            'hovertemplate': 'Country: ' + country +
+                             '<br>Date: %{customdata}<br>' +
+                             total_metric_text + ': %{x:,}<br>' +
+                             weekly_metric_text + ': %{y:,}<extra></extra>'
+        },
+        {
+            'x': df_[metric_col].tail(1),
+            'y': df_[weekly_metric_col].tail(1),
+            'text': country,
+            'textposition': 'middle right',
+            'mode': 'markers+text',
+            'marker': {
+                'size': label_marker_size,
+                'line': {
+                    'width': label_line_width,
+                    'color': 'white',
                 },
-                'hoverinfo': 'none'
-            }
+                'color': 'grey'
+            },
+            'hoverinfo': 'none'
+        }
+    ]
+
+
+def plot_metric_trajectory(country_index, country, metric, ref_countries=()):
+    # The traces of the main country and of every reference country are built
+    # once, the references are drawn on top of the main country
+    total_metric_text, weekly_metric_text, title_text = trajectory_texts(metric)
+    fig = {
+        'data': trajectory_traces(country_index, country, metric, is_main_country=True) + [
+            trace
+            for ref_country in ref_countries
+            for trace in trajectory_traces(country_index, ref_country, metric, is_main_country=False)
         ],
         'layout': {
             'title': '<b>Trajectory of ' + title_text,
@@ -163,7 +160,6 @@ def plot_metric_trajectory(data, country, metric, is_main_country):
             'xaxis': {
                 'title': total_metric_text,
                 'type': 'log',
-                #'range': [0, np.log10(upper_range)]
             },
             'showlegend': False
 
@@ -172,108 +168,141 @@ def plot_metric_trajectory(data, country, metric, is_main_country):
     return fig
 
 
-def plot_flat_deaths(data,
-                     ref_countries,
-                     country,
-                     num_deaths):
-    rest_countries = list(set(data.country.unique().tolist()) - set(ref_countries + [country]))
+def threshold_data(country_index, country, column, threshold):
+    # Rows of a country after the column first reached the threshold, with
+    # the number of days since then. They are stored by prepare_data.py for
+    # the thresholds of the dashboard and counted here for any other one.
+    country_data = country_index.get(country)
+    days_since_col = days_since_column(column, threshold)
+    if days_since_col in country_data:
+        country_data = country_data[country_data[days_since_col] >= 0]
+        return country_data.assign(days_since=country_data[days_since_col])
+    country_data = country_data[country_data[column] >= threshold].reset_index(drop=True)
+    country_data['days_since'] = country_data.index
+    return country_data
 
-    flat_data = data[data.deaths >= num_deaths].reset_index(0, drop=True)
 
-    flat_data['days_since'] = flat_data.groupby('country').deaths\
-        .cumcount()\
-        .reset_index(0, drop=True)
+def build_background_lines(country_index, column, threshold, value_column,
+                           max_points=BACKGROUND_POINTS):
+    # The grey lines of all countries only change with the data, so their
+    # x/y arrays are built once per country index and reused by every figure.
+    # Longer lines are decimated to max_points with LTTB, on the log scale
+    # of the plots. Each line ends with a NaN, which breaks the line when
+    # they are joined.
+    key = ('background_lines', column, threshold, value_column, max_points)
+    if key not in country_index.derived:
+        background_lines = {}
+        for c in country_index:
+            country_data = threshold_data(country_index, c, column, threshold)
+            x = country_data.days_since.values.astype(float)
+            y = country_data[value_column].values.astype(float)
+            if len(x) > max_points:
+                # Missing values are not drawn, they are left out of the
+                # decimated line
+                finite = np.flatnonzero(np.isfinite(y))
+                kept = finite[lttb(x[finite], np.log10(np.maximum(y[finite], 1e-9)), max_points)]
+                x, y = x[kept], y[kept]
+            background_lines[c] = (np.append(x, np.nan), np.append(y, np.nan))
+        country_index.derived[key] = background_lines
+    return country_index.derived[key]
+
+
+def background_trace(background_lines, highlighted_countries):
+    # A single trace for all the countries that are not highlighted
+    highlighted_countries = set(highlighted_countries)
+    lines = [line for c, line in background_lines.items()
+             if c not in highlighted_countries]
+    return {
+        'x': np.concatenate([x for x, _ in lines]) if lines else [],
+        'y': np.concatenate([y for _, y in lines]) if lines else [],
+        'mode': 'lines',
+        'line': {
+            'shape': 'spline',
+            'smoothing': 1.3
+        },
+        'marker': {
+            'color': '#565656'
+        },
+        'connectgaps': False,
+        'hoverinfo': 'none'
+    }
 
-    flat_data['flat_hovertexts'] = 'Country: ' + \
-                                   flat_data.country + \
-                                   '<br>Deaths: ' + \
-                                   flat_data.flat_ma.round(2).map(str) + \
-                                   '<br>Days: ' + \
-                                   flat_data.days_since.map(str)
 
-    country_flat_data = flat_data[flat_data.country == country].reset_index(drop=True)
+def flat_hovertemplate(country):
+    return 'Country: ' + country + '<br>Deaths: %{y:.2f}<br>Days: %{x}<extra></extra>'
 
+
+def rate_hovertemplate(country):
+    return 'Country: ' + country + '<br>Death rate: %{y:.2f}<br>Days: %{x}<extra></extra>'
+
+
+def threshold_traces(country_data, country, value_column, hovertemplate, is_main_country):
+    # The line and the label of a country in the threshold figures
+    if is_main_country:
+        line = {'shape': 'spline', 'smoothing': 1.3, 'width': 4}
+        marker = {'color': 'white'}
+        label_marker_size = 8
+        label_line_width = 2
+    else:
+        line = {'shape': 'spline', 'smoothing': 1.3}
+        marker = {}
+        label_marker_size = 6
+        label_line_width = 1
+    return [
+        {
+            'x': country_data.days_since,
+            'y': country_data[value_column],
+            'mode': 'lines',
+            'line': line,
+            'name': country,
+            'marker': marker,
+            'hovertemplate': hovertemplate(country),
+        },
+        {
+            'x': country_data.days_since.tail(1),
+            'y': country_data[value_column].tail(1),
+            'text': country,
+            'textposition': 'middle right',
+            'mode': 'markers+text',
+            'marker': {
+                'size': label_marker_size,
+                'line': {
+                    'width': label_line_width,
+                    'color': 'white',
+                },
+                'color': 'grey'
+            },
+            'hoverinfo': 'none'
+        }
+    ]
+
+
+def threshold_figure_data(country_index, country, ref_countries, column, threshold,
+                          value_column, hovertemplate):
+    # The traces of a threshold figure, each built once: the grey lines of the
+    # other countries, the lines then the labels of the references and the
+    # line and label of the main country on top
+    background_lines = build_background_lines(country_index, column, threshold, value_column)
+    ref_traces = [
+        threshold_traces(threshold_data(country_index, c, column, threshold),
+                         c, value_column, hovertemplate, is_main_country=False)
+        for c in ref_countries
+    ]
+    main_traces = threshold_traces(threshold_data(country_index, country, column, threshold),
+                                   country, value_column, hovertemplate, is_main_country=True)
+    return [background_trace(background_lines, ref_countries + [country])] + \
+        [line for line, _ in ref_traces] + \
+        [label for _, label in ref_traces] + \
+        main_traces
+
+
+def plot_flat_deaths(country_index,
+                     ref_countries,
+                     country,
+                     num_deaths):
     fig = {
-        'data': [
-                    {
-                        'x': flat_data[flat_data.country == c].days_since,
-                        'y': flat_data[flat_data.country == c].flat_ma,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3
-                        },
-                        'marker': {
-                            'color': '#565656'
-                        },
-                        'hoverinfo': 'none'
-                    } for c in rest_countries
-                ] + [
-                    {
-                        'x': flat_data[flat_data.country == c].days_since,
-                        'y': flat_data[flat_data.country == c].flat_ma,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3
-                        },
-                        'name': c,
-                        'marker': {
-                            # 'color': 'lightgrey'
-                        },
-                        'hoverinfo': 'text',
-                        'hovertext': flat_data[flat_data.country == c]['flat_hovertexts'],
-                    } for c in ref_countries
-                ] + [
-                    {
-                        'x': flat_data[flat_data.country == c].days_since.tail(1),
-                        'y': flat_data[flat_data.country == c].flat_ma.tail(1),
-                        'text': c,
-                        'textposition': 'middle right',
-                        'mode': 'markers+text',
-                        'marker': {
-                            'size': 6,
-                            'line': {
-                                'width': 1,
-                                'color': 'white',
-                            },
-                            'color': 'grey'
-                        },
-                        'hoverinfo': 'none'
-                    } for c in ref_countries
-                ] + [
-                    {
-                        'x': country_flat_data.days_since,
-                        'y': country_flat_data.flat_ma,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3,
-                            'width': 4
-                        },
-                        'name': 'Greece',
-                        'marker': {
-                            'color': 'white'
-                        },
-                        'hoverinfo': 'text',
-                        'hovertext': country_flat_data['flat_hovertexts'],
-                    },
-                    {
-                        'x': country_flat_data.days_since.tail(1),
-                        'y': country_flat_data.flat_ma.tail(1),
-                        'mode': 'markers+text',
-                        'text': country,
-                        'textposition': 'middle right',
-                        'marker': {
-                            'size': 8,
-                            'line': {
-                                'width': 2,
-                                'color': 'white',
-                            },
-                            'color': 'grey'
-                        },
-                        'hoverinfo': 'none'
-                    }],
+        'data': threshold_figure_data(country_index, country, ref_countries,
+                                      'deaths', num_deaths, 'flat_ma', flat_hovertemplate),
         'layout': {
             'title': '<b>Daily deaths in ' + country + '</b>',
             'showlegend': False,
@@ -297,107 +326,13 @@ def plot_flat_deaths(data,
     return fig
 
 
-def plot_rate_deaths(data,
+def plot_rate_deaths(country_index,
                      country,
                      ref_countries,
                      death_rate):
-    rest_countries = list(set(data.country.unique().tolist()) - set(ref_countries + [country]))
-
-    rate_data = data[data.death_rate >= death_rate].reset_index(0, drop=True)
-
-    rate_data['days_since'] = rate_data.groupby('country').deaths \
-        .cumcount() \
-        .reset_index(0, drop=True)
-
-    rate_data['rate_hovertexts'] = 'Country: ' + \
-                                   rate_data.country + \
-                                   '<br>Death rate: ' + \
-                                   rate_data.death_rate.round(2).map(str) + \
-                                   '<br>Days: ' + \
-                                   rate_data.days_since.map(str)
-    country_rate_data = rate_data[rate_data.country == country].reset_index(drop=True)
-
     fig = {
-        'data': [
-                    {
-                        'x': rate_data[rate_data.country == c].days_since,
-                        'y': rate_data[rate_data.country == c].death_rate,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3
-                        },
-                        'marker': {
-                            'color': '#565656'
-                        },
-                        'hoverinfo': 'none'
-                    } for c in rest_countries
-                ] + [
-                    {
-                        'x': rate_data[rate_data.country == c].days_since,
-                        'y': rate_data[rate_data.country == c].death_rate,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3
-                        },
-                        'name': c,
-                        'marker': {
-                            # 'color': 'lightgrey'
-                        },
-                        'hoverinfo': 'text',
-                        'hovertext': rate_data[rate_data.country == c]['rate_hovertexts'],
-                    } for c in ref_countries
-                ] + [
-                    {
-                        'x': rate_data[rate_data.country == c].days_since.tail(1),
-                        'y': rate_data[rate_data.country == c].death_rate.tail(1),
-                        'text': c,
-                        'textposition': 'middle right',
-                        'mode': 'markers+text',
-                        'marker': {
-                            'size': 6,
-                            'line': {
-                                'width': 1,
-                                'color': 'white',
-                            },
-                            'color': 'grey'
-                        },
-                        'hoverinfo': 'none'
-                    } for c in ref_countries
-                ] + [
-                    {
-                        'x': country_rate_data.days_since,
-                        'y': country_rate_data.death_rate,
-                        'mode': 'lines',
-                        'line': {
-                            'shape': 'spline',
-                            'smoothing': 1.3,
-                            'width': 4
-                        },
-                        'name': country,
-                        'marker': {
-                            'color': 'white'
-                        },
-                        'hoverinfo': 'text',
-                        'hovertext': country_rate_data['rate_hovertexts'],
-                    },
-                    {
-                        'x': country_rate_data.days_since.tail(1),
-                        'y': country_rate_data.death_rate.tail(1),
-                        'mode': 'markers+text',
-                        'text': country,
-                        'textposition': 'middle right',
-                        'marker': {
-                            'size': 8,
-                            'line': {
-                                'width': 2,
-                                'color': 'white',
-                            },
-                            'color': 'grey'
-                        },
-                        'hoverinfo': 'none'
-                    }],
+        'data': threshold_figure_data(country_index, country, ref_countries,
+                                      'death_rate', death_rate, 'death_rate', rate_hovertemplate),
         'layout': {
             'title': '<b>Daily death rate in ' + country +'</b>',
             'showlegend': False,
@@ -0,0 +1,382 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+# pandas is imported by the functions that need it, so that the app can
+# start and serve its layout from the stored summary without it
+
+PROCESSED_DATA_DIR = './data/processed'
+PROCESSED_CSV_PATH = './data/processed_data.csv'
+CATEGORY_COLUMNS = ['country', 'continent']
+SUMMARY_COLUMNS = ['Rank',
+                   'Country / Continent',
+                   'Continent',
+                   'Population',
+                   'Date of first case',
+                   'Date of first death',
+                   'Total cases',
+                   'Total deaths',
+                   'Deaths per million',
+                   'Deaths to cases']
+
+logger = logging.getLogger(__name__)
+
+
+def data_version(path):
+    # Token that changes whenever the processed data file is rewritten
+    stat = os.stat(path)
+    return '%d-%d' % (stat.st_mtime_ns, stat.st_size)
+
+
+def days_since_column(column, threshold):
+    # Name of the column prepare_data.py stores with the number of days since
+    # `column` first reached `threshold` in a country (-1 before that)
+    return 'days_since_%s_%g' % (column, threshold)
+
+
+def build_summary(data):
+    # Summary of every country / continent for the dash table, in a single
+    # grouped aggregation over the processed data
+    summary_df = data.assign(first_death=data.date.where(data.deaths > 0))\
+        .groupby(['country', 'continent'], observed=True)\
+        .agg(**{'Population': ('population', 'max'),
+                'Date of first case': ('date', 'min'),
+                'Date of first death': ('first_death', 'min'),
+                'Total cases': ('confirmed', 'max'),
+                'Total deaths': ('deaths', 'max')})\
+        .reset_index()\
+        .rename(columns={'country': 'Country / Continent',
+                         'continent': 'Continent'})
+    for column in ['Country / Continent', 'Continent']:
+        summary_df[column] = summary_df[column].astype(str)
+    for column in ['Date of first case', 'Date of first death']:
+        summary_df[column] = summary_df[column].dt.strftime('%Y-%m-%d')
+    return _rank_summary(summary_df)
+
+
+def update_summary(summary_df, new_data):
+    # Add the rows of newly appended days to a summary. Populations and totals
+    # are maxima and first dates are minima, so the summary of the new days
+    # only needs to be merged with the existing one. Days that replace already
+    # summarized ones (e.g. corrected totals) need build_summary instead.
+    import pandas as pd
+    merged = pd.concat([summary_df, build_summary(new_data)], sort=False)
+    # The dates are strings, missing (None or NaN) for the countries without
+    # deaths yet, which can't be compared with the dates of the new days
+    for column in ['Date of first case', 'Date of first death']:
+        merged[column] = pd.to_datetime(merged[column])
+    merged = merged.groupby(['Country / Continent', 'Continent'])\
+        .agg({'Population': 'max',
+              'Date of first case': 'min',
+              'Date of first death': 'min',
+              'Total cases': 'max',
+              'Total deaths': 'max'})\
+        .reset_index()
+    for column in ['Date of first case', 'Date of first death']:
+        merged[column] = merged[column].dt.strftime('%Y-%m-%d')
+    return _rank_summary(merged)
+
+
+def _rank_summary(summary_df):
+    summary_df['Deaths per million'] = summary_df['Total deaths'] / summary_df['Population'] * 1000000
+    summary_df['Deaths to cases'] = summary_df['Total deaths'] / summary_df['Total cases']
+    summary_df = summary_df.sort_values('Total cases', ascending=False).reset_index(drop=True)
+    summary_df['Rank'] = summary_df.index + 1
+    return summary_df[SUMMARY_COLUMNS]
+
+
+def listed_countries(data):
+    # The countries of the dropdowns, in the order of the aggregated data
+    # before it is stored sorted: the countries, then the world, then the
+    # continents, each by name
+    import pandas as pd
+    continents = set(pd.unique(data.continent.astype(str))) - {'World'}
+
+    def position(name):
+        return 2 if name in continents else 1 if name == 'World' else 0, name
+    return sorted(pd.unique(data.country.astype(str)), key=position)
+
+
+def processed_data_path(directory=PROCESSED_DATA_DIR, csv_path=PROCESSED_CSV_PATH):
+    # The metadata of the binary store if there is one, the CSV otherwise
+    meta_path = os.path.join(directory, 'meta.json')
+    return meta_path if os.path.exists(meta_path) else csv_path
+
+
+def replace_file(path, write, mode='wb'):
+    # Write next to the target and rename, so that readers never see a
+    # half written file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_processed_data(data, directory=PROCESSED_DATA_DIR, summary_df=None):
+    # Store every column as a typed .npy file: categories as small integer
+    # codes, dates as datetime64[D] and integers with the narrowest width
+    # that fits. The summary of the table is stored as JSON records next to
+    # them. meta.json is written last and describes the files.
+    # The files are named after the version they belong to, so a reader
+    # holding the previous meta.json never mixes two versions.
+    # meta.json also holds what the layout of the app needs (the date of the
+    # last update and the countries), so the app can start without the data.
+    import pandas as pd
+    os.makedirs(directory, exist_ok=True)
+    previous_meta = load_meta(directory)
+    version = '%x' % time.time_ns()
+    meta = {'version': version, 'rows': len(data), 'columns': [], 'files': {},
+            'categories': {},
+            'last_update': data.date.max().strftime('%Y-%m-%d') if len(data) else None,
+            'countries': listed_countries(data)}
+    for column in data.columns:
+        values = data[column]
+        if column in CATEGORY_COLUMNS:
+            categorical = pd.Categorical(values)
+            meta['categories'][column] = categorical.categories.tolist()
+            array = categorical.codes.astype(np.int16)
+        elif np.issubdtype(values.dtype, np.datetime64):
+            array = values.values.astype('datetime64[D]')
+        elif np.issubdtype(values.dtype, np.integer):
+            array = values.values
+            if array.size == 0 or (array.min() >= np.iinfo(np.int32).min and
+                                   array.max() <= np.iinfo(np.int32).max):
+                array = array.astype(np.int32)
+        else:
+            array = values.values.astype(np.float64)
+        file_name = column + '.' + version + '.npy'
+        replace_file(os.path.join(directory, file_name),
+                      lambda f: np.save(f, array))
+        meta['columns'].append(column)
+        meta['files'][column] = file_name
+    if summary_df is not None:
+        meta['summary'] = 'summary.' + version + '.json'
+        records = summary_df[SUMMARY_COLUMNS].to_dict('records')
+        replace_file(os.path.join(directory, meta['summary']),
+                      lambda f: json.dump(records, f), mode='w')
+    replace_file(os.path.join(directory, 'meta.json'),
+                  lambda f: json.dump(meta, f), mode='w')
+    # Remove the files of older versions, except the previous one: the app
+    # may hold a snapshot of it whose data isn't loaded yet, until it swaps
+    # in the new version
+    kept_files = set()
+    for kept_meta in [meta, previous_meta]:
+        if kept_meta is not None:
+            kept_files |= set(kept_meta.get('files', {}).values()) | {kept_meta.get('summary')}
+    for file_name in os.listdir(directory):
+        if (file_name.endswith('.npy') or file_name.startswith('summary.')) \
+                and file_name not in kept_files:
+            os.remove(os.path.join(directory, file_name))
+
+
+def load_meta(directory=PROCESSED_DATA_DIR):
+    # The metadata of the binary store, None without one
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def load_processed_info(directory=PROCESSED_DATA_DIR):
+    # The metadata of the binary store and the stored summary records, read
+    # without loading the data. Returns (None, None) without a binary store.
+    meta = load_meta(directory)
+    if meta is None:
+        return None, None
+    summary_records = None
+    if 'summary' in meta:
+        with open(os.path.join(directory, meta['summary'])) as f:
+            summary_records = json.load(f)
+    return meta, summary_records
+
+
+def load_processed_data(directory=PROCESSED_DATA_DIR, csv_path=PROCESSED_CSV_PATH, meta=None):
+    # Load the binary store written by prepare_data.py, or fall back to the
+    # CSV and give it the same dtypes. With a meta from load_processed_info,
+    # the data of that version is loaded even if the store was rewritten since.
+    import pandas as pd
+    if meta is None:
+        meta, _ = load_processed_info(directory)
+    if meta is None:
+        data = pd.read_csv(csv_path, parse_dates=['date'],
+                           dtype={c: 'category' for c in CATEGORY_COLUMNS})
+        data['population'] = data.population.fillna(0).astype(np.int64)
+        return data
+
+    columns = {}
+    for column in meta['columns']:
+        array = np.load(os.path.join(directory, meta['files'][column]))
+        if len(array) != meta['rows']:
+            raise ValueError('Column ' + column + ' of the processed data in ' +
+                             directory + ' does not match meta.json')
+        if column in meta['categories']:
+            array = pd.Categorical.from_codes(array, meta['categories'][column])
+        columns[column] = array
+    return pd.DataFrame(columns, columns=meta['columns'])
+
+
+def load_processed_store(directory=PROCESSED_DATA_DIR, csv_path=PROCESSED_CSV_PATH):
+    # The data and the stored summary as a frame, which is None if the store
+    # has none
+    import pandas as pd
+    meta, summary_records = load_processed_info(directory)
+    data = load_processed_data(directory, csv_path, meta)
+    if summary_records is None:
+        return data, None
+    return data, pd.DataFrame(summary_records, columns=SUMMARY_COLUMNS)
+
+
+class CountryIndex:
+    # Sorts the processed data by country and date once and keeps the
+    # start/end offsets of every country, so that the plots can get the
+    # rows of a country with a slice instead of scanning the whole frame.
+    def __init__(self, data):
+        import pandas as pd
+        # prepare_data.py already stores the data sorted, in which case the
+        # index shares the columns of the loaded frame instead of copying them
+        keys = data[['country', 'date']].reset_index(drop=True)
+        order = keys.sort_values(['country', 'date'], kind='mergesort').index.values
+        if (order != np.arange(len(order))).any():
+            self.data = data.iloc[order]
+        else:
+            self.data = data.copy(deep=False)
+        country_values = np.asarray(self.data.country)
+        starts = np.flatnonzero(
+            np.r_[True, country_values[1:] != country_values[:-1]])
+        ends = np.r_[starts[1:], len(country_values)]
+        self.offsets = {
+            country_values[start]: (start, end)
+            for start, end in zip(starts, ends)
+        }
+        self.countries = list(self.offsets)
+        # Date labels for the hovers, formatted once per data version. They
+        # are kept as a categorical of the distinct days, so that they don't
+        # add an object column with a string per row to every worker.
+        days = self.data.date.values.astype('datetime64[D]')
+        first_day = days.min()
+        self.data['date_label'] = pd.Categorical.from_codes(
+            (days - first_day).astype(np.int64),
+            np.datetime_as_string(np.arange(first_day, days.max() + 1)))
+        # Structures derived from the data (e.g. the background lines of the
+        # plots), built once per index and so once per data version
+        self.derived = {}
+
+    def __getitem__(self, country):
+        start, end = self.offsets[country]
+        return self.data.iloc[start:end]
+
+    def get(self, country):
+        # Unknown countries get an empty frame, like a boolean scan would
+        start, end = self.offsets.get(country, (0, 0))
+        return self.data.iloc[start:end]
+
+    def __contains__(self, country):
+        return country in self.offsets
+
+    def __iter__(self):
+        return iter(self.countries)
+
+    def __len__(self):
+        return len(self.countries)
+
+
+class DataStore:
+    # Holds the snapshot built from the current processed data and swaps in
+    # a new one when prepare_data.py rewrites it.
+    # build_snapshot(version, meta, summary_records, load_data) builds
+    # everything derived from the data and must return an object with a
+    # version attribute. meta and summary_records come from
+    # load_processed_info (None for older stores or the CSV) and load_data()
+    # loads the data of the same version, so the snapshot can defer it.
+    # warm_up(snapshot), if given, builds what the snapshot defers. It runs
+    # before a reloaded snapshot is swapped in and in the background for the
+    # first snapshot of a process.
+    # Callbacks should take current() once and use that snapshot throughout,
+    # so that a swap in the middle of a callback doesn't mix two versions.
+    # Every process polls and loads the new versions on its own, unless
+    # follow_changes is turned off, e.g. in the workers of a gunicorn master
+    # that reloads the data itself (see gunicorn.conf.py). The watcher thread
+    # then only warms up the first snapshot. It is started by the first call
+    # to current(), or before any request by start_watching().
+    def __init__(self, build_snapshot, directory=PROCESSED_DATA_DIR,
+                 csv_path=PROCESSED_CSV_PATH, poll_interval=60, warm_up=None):
+        self.build_snapshot = build_snapshot
+        self.directory = directory
+        self.csv_path = csv_path
+        self.poll_interval = poll_interval
+        self.warm_up = warm_up
+        self.follow_changes = True
+        self.swap_listeners = []
+        self.reload_lock = threading.Lock()
+        self.watcher_pid = None
+        self.snapshot = self.load()
+
+    def version(self, meta=None):
+        # The version written in meta.json, so that it always matches the
+        # files meta.json lists. Older stores and the CSV are versioned by
+        # the modification of the file.
+        if meta is None:
+            meta = load_meta(self.directory)
+        if meta is not None and 'version' in meta:
+            return meta['version']
+        return data_version(processed_data_path(self.directory, self.csv_path))
+
+    def load(self):
+        meta, summary_records = load_processed_info(self.directory)
+        version = self.version(meta)
+        return self.build_snapshot(
+            version, meta, summary_records,
+            lambda: load_processed_data(self.directory, self.csv_path, meta))
+
+    def current(self):
+        # The watcher thread is started lazily, in the process that serves
+        # the requests, because threads don't survive gunicorn's fork
+        if self.poll_interval and self.watcher_pid != os.getpid():
+            self.start_watching()
+        return self.snapshot
+
+    def on_swap(self, listener):
+        self.swap_listeners.append(listener)
+
+    def reload_if_changed(self, warm_up=True):
+        with self.reload_lock:
+            if self.version() == self.snapshot.version:
+                return False
+            snapshot = self.load()
+            if warm_up and self.warm_up is not None:
+                self.warm_up(snapshot)
+            # A single assignment, so requests see either the old or the new
+            # snapshot and never a mix of both
+            self.snapshot = snapshot
+        logger.info('Loaded processed data version %s', snapshot.version)
+        for listener in self.swap_listeners:
+            listener(snapshot)
+        return True
+
+    def start_watching(self):
+        with self.reload_lock:
+            if self.watcher_pid == os.getpid():
+                return
+            self.watcher_pid = os.getpid()
+        thread = threading.Thread(target=self._watch, name='data-store-watcher')
+        thread.daemon = True
+        thread.start()
+
+    def _watch(self):
+        if self.warm_up is not None:
+            try:
+                self.warm_up(self.snapshot)
+            except Exception:
+                logger.exception('Could not warm up the processed data')
+        while self.follow_changes:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload_if_changed()
+            except Exception:
+                # e.g. prepare_data.py is still writing, retry on next poll
+                logger.exception('Could not reload the processed data')
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+from plotly.utils import PlotlyJSONEncoder
+
+
+def code_token(paths, *settings):
+    # Hash of the source files and the settings the payloads are built from
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()[:12]
+
+
+class DiskCache:
+    # JSON payloads (figures, ...) cached as gzipped files, shared by all the
+    # processes of a server (e.g. the gunicorn workers) and kept across
+    # restarts. The files of a data version are kept in a directory of their
+    # own, so that older versions can be removed at once. When the files take
+    # more than max_bytes, the least recently used ones are removed.
+    # Any number of processes can read and write at the same time: files are
+    # written to a temporary file and renamed, so readers never see a half
+    # written payload, and a file removed by another process is a miss.
+    # Walking the whole cache is slow, so every process only does it after
+    # writing scan_bytes since its last walk (the cache can exceed max_bytes
+    # by that much per process in between), and the last use of a file is
+    # only updated if it is older than touch_interval seconds.
+    # A process that builds a payload can hold a lock file next to it (see
+    # claim), so that the others wait for it instead of building the same
+    # payload at the same time. Locks older than lock_timeout seconds were
+    # left by a process that died and are ignored.
+    # token identifies the code the payloads are built with (see
+    # code_token), so that a new release doesn't find the payloads of the
+    # previous one. It is part of the directory of every data version.
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, scan_bytes=None,
+                 touch_interval=600, lock_timeout=60, token=None):
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        self.token = token
+        self.max_bytes = max_bytes
+        self.scan_bytes = max_bytes // 16 if scan_bytes is None else scan_bytes
+        self.touch_interval = touch_interval
+        self.written_bytes = 0
+        self.lock = threading.Lock()
+
+    def path(self, key, data_version):
+        # key must be built from normalized inputs, e.g. by figure_key
+        name = hashlib.sha1(repr(key).encode()).hexdigest() + '.json.gz'
+        return os.path.join(self.directory, self.version_directory(data_version), name)
+
+    def version_directory(self, data_version):
+        if self.token is None:
+            return str(data_version)
+        return '%s-%s' % (data_version, self.token)
+
+    def load(self, key, data_version):
+        # The payload and the bytes of its JSON, (None, 0) if not cached
+        path = self.path(key, data_version)
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                text = gzip.decompress(f.read())
+            payload = json.loads(text)
+            # The modification time is the last use, for the eviction
+            if stat.st_mtime < time.time() - self.touch_interval:
+                os.utime(path)
+        except (OSError, EOFError, ValueError, zlib.error):
+            return None, 0
+        return payload, len(text)
+
+    def set(self, key, data_version, payload):
+        # Returns the bytes of the JSON of the payload. A payload that can't
+        # be written (e.g. a full disk, or the directory of its version
+        # removed by prune) is just not cached.
+        path = self.path(key, data_version)
+        text = json.dumps(payload, cls=PlotlyJSONEncoder).encode()
+        compressed = gzip.compress(text, compresslevel=6)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A temporary file of its own, as several threads or processes may
+            # write the same payload
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None:
+                self.remove(tmp_path)
+            return len(text)
+        with self.lock:
+            self.written_bytes += len(compressed)
+            scan = self.written_bytes >= self.scan_bytes
+            if scan:
+                self.written_bytes = 0
+        if scan:
+            self.evict()
+        return len(text)
+
+    def claim(self, key, data_version):
+        # Takes the lock of building a payload. Returns False if another
+        # process (or thread) holds it, True otherwise, including when the
+        # lock file can't be written, in which case the payload is built
+        # without it.
+        lock_path = self.path(key, data_version) + '.lock'
+        for _ in range(2):
+            try:
+                os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                if self.locked(lock_path):
+                    return False
+                # Left by a process that died, taken over
+                self.remove(lock_path)
+                continue
+            except OSError:
+                pass
+            return True
+        return False
+
+    def release(self, key, data_version):
+        self.remove(self.path(key, data_version) + '.lock')
+
+    def locked(self, lock_path):
+        try:
+            return os.stat(lock_path).st_mtime >= time.time() - self.lock_timeout
+        except OSError:
+            return False
+
+    def wait(self, key, data_version, poll_interval=0.05):
+        # Waits for the process that holds the lock of a payload and returns
+        # the payload like load, (None, 0) if it wasn't written
+        lock_path = self.path(key, data_version) + '.lock'
+        while self.locked(lock_path):
+            time.sleep(poll_interval)
+        return self.load(key, data_version)
+
+    def files(self):
+        # (last use, size, path) of every cached payload
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # Temporary and lock files of writers that died are removed
+                # after an hour
+                if name.endswith(('.tmp', '.lock')):
+                    if stat.st_mtime < time.time() - 3600:
+                        self.remove(path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process
+            pass
+
+    def prune(self, data_version):
+        # Remove the payloads of every other data version, and those built
+        # with another token
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name != self.version_directory(data_version):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def stats(self):
+        files = self.files()
+        return {
+            'files': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes
+        }
@@ -1,27 +1,137 @@
-import pandas as pd
-from datetime import date, timedelta
+import argparse
+import json
+import os
 import pathlib
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
-# Create the directory needed to save the raw data, if not already there.
-pathlib.Path('./data/raw_data/').mkdir(exist_ok=True)
+from corona_package.data_store import replace_file
 
-prefix = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/'
+PREFIX = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/'
+RAW_DATA_DIR = './data/raw_data'
+# The actual first date of data
+FIRST_DATE = date(2020, 1, 22)
+# Reports of the last days may still be corrected upstream, so they are
+# checked again with conditional requests. Older reports on disk are complete.
+REFRESH_DAYS = 3
+# ETag / Last-Modified of the downloaded reports, for the conditional requests
+VALIDATORS_FILE = '.validators.json'
 
-last_date = date.today()
-first_date = last_date - timedelta(days=30) # the actual first date of data is 2020-01-22 but we only udtate the 30 last days
 
-num_days = (last_date - first_date).days
-dates = [(first_date + timedelta(days=d)).strftime(format='%m-%d-%Y') for d in range(num_days)]
-urls = [prefix + date + '.csv' for date in dates]
-max_date = date(1900,1,1)
+def report_dates(first_date, last_date):
+    num_days = (last_date - first_date).days
+    return [first_date + timedelta(days=d) for d in range(num_days)]
 
-for date in dates:
-	url = prefix + date + '.csv'
-	try:
-		pd.read_csv(url).to_csv('./data/raw_data/' + date + '.csv', index=False)
-		max_date = date
-	except:
-		continue	
 
-print('Downloaded data until: ', max_date)
+def report_name(day):
+    return day.strftime(format='%m-%d-%Y') + '.csv'
 
+
+def load_validators(directory):
+    try:
+        with open(os.path.join(directory, VALIDATORS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_validators(directory, validators):
+    replace_file(os.path.join(directory, VALIDATORS_FILE),
+                 lambda f: json.dump(validators, f, indent=1, sort_keys=True),
+                 mode='w')
+
+
+def download_report(day, base_url, directory, validators, retries=3, backoff=1.0, timeout=30):
+    # Download the report of a day straight to disk. Returns 'downloaded',
+    # 'not_modified' or 'missing' (the report is not published yet).
+    name = report_name(day)
+    path = os.path.join(directory, name)
+    request = urllib.request.Request(base_url + name)
+    if os.path.exists(path) and name in validators:
+        if validators[name].get('etag'):
+            request.add_header('If-None-Match', validators[name]['etag'])
+        if validators[name].get('last_modified'):
+            request.add_header('If-Modified-Since', validators[name]['last_modified'])
+
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                content = response.read()
+                headers = response.headers
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 'not_modified'
+            if e.code == 404:
+                return 'missing'
+            if e.code < 500 or attempt == retries:
+                raise
+        except (urllib.error.URLError, OSError):
+            if attempt == retries:
+                raise
+        time.sleep(backoff * 2 ** attempt)
+
+    # An interrupted download never leaves a truncated report behind
+    replace_file(path, lambda f: f.write(content))
+    validators[name] = {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified')
+    }
+    return 'downloaded'
+
+
+def download_data(first_date, last_date, base_url=PREFIX, directory=RAW_DATA_DIR,
+                  workers=8, refresh_days=REFRESH_DAYS):
+    # Download the daily reports from first_date until the day before
+    # last_date, with at most `workers` connections at a time. Returns the
+    # status of every day ('skipped' for reports that are already complete).
+    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+    validators = load_validators(directory)
+    refresh_from = last_date - timedelta(days=refresh_days)
+
+    statuses = {}
+    to_download = []
+    for day in report_dates(first_date, last_date):
+        if day < refresh_from and os.path.exists(os.path.join(directory, report_name(day))):
+            statuses[day] = 'skipped'
+        else:
+            to_download.append(day)
+
+    def download(day):
+        try:
+            return download_report(day, base_url, directory, validators)
+        except Exception as e:
+            print('Could not download', report_name(day), '-', e)
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses.update(zip(to_download, executor.map(download, to_download)))
+    save_validators(directory, validators)
+    return statuses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download the JHU daily reports.')
+    # We only update the 30 last days by default, use --since 2020-01-22 for
+    # a full backfill
+    parser.add_argument('--since', default=(date.today() - timedelta(days=30)).isoformat(),
+                        help='first date to download (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of parallel connections')
+    parser.add_argument('--base-url', default=PREFIX)
+    args = parser.parse_args()
+
+    statuses = download_data(
+        first_date=max(datetime.strptime(args.since, '%Y-%m-%d').date(), FIRST_DATE),
+        last_date=date.today(),
+        base_url=args.base_url,
+        workers=args.workers)
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    print('Reports:', ', '.join('%s %d' % item for item in sorted(counts.items())))
+    available = [day for day, status in statuses.items() if status not in ('missing', 'failed')]
+    print('Downloaded data until: ', max(available) if available else None)
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+
+def figure_key(plot_name, country, ref_countries, metric, data_version):
+    # Normalize the callback inputs, so that equivalent selections share
+    # the same cached figure.
+    if country is None:
+        country = 'World'
+    if ref_countries is not None:
+        ref_countries = tuple(sorted(ref_countries))
+    return plot_name, country, ref_countries, metric, data_version
+
+
+class FigureCache:
+    # Bounded LRU cache for the figures of the covid_plot functions.
+    # Cached figures are shared between requests and must not be mutated.
+    # build_figure() returns the figure and its size in bytes (e.g. of its
+    # JSON, known when it is written to or read from the disk cache), and
+    # the least recently used figures are removed once the cached ones take
+    # more than max_bytes. The newest figure is always kept.
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.figures = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, build_figure):
+        with self.lock:
+            if key in self.figures:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return self.figures[key]
+            self.misses += 1
+        # Build outside of the lock, so that a slow figure doesn't block
+        # the cache hits of other requests
+        figure, size = build_figure()
+        with self.lock:
+            if key in self.figures:
+                self.total_bytes -= self.sizes[key]
+            self.figures[key] = figure
+            self.figures.move_to_end(key)
+            self.sizes[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.figures) > 1:
+                evicted_key, _ = self.figures.popitem(last=False)
+                self.total_bytes -= self.sizes.pop(evicted_key)
+                self.evictions += 1
+        return figure
+
+    def prune(self, data_version):
+        # Remove the figures of every other data version
+        with self.lock:
+            for key in [k for k in self.figures if k[-1] != data_version]:
+                del self.figures[key]
+                self.total_bytes -= self.sizes.pop(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.figures),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,102 @@
+import base64
+import json
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+# Properties of the traces that hold one value per point
+ARRAY_PROPERTIES = ['x', 'y', 'customdata']
+
+
+def round_significant(values, digits=7):
+    # Round to the precision of a float32, so that the values are written with
+    # at most `digits` significant digits instead of the 17 of a float64.
+    # The rounded value is an exact integer divided or multiplied by an exact
+    # power of ten, which gives the float64 nearest to the short decimal.
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values) & (values != 0)
+    exponent = np.zeros(values.shape, dtype=np.int64)
+    exponent[finite] = np.floor(np.log10(np.abs(values[finite]))).astype(np.int64)
+    decimals = np.clip(digits - 1 - exponent, -22, 22)
+    scale = 10.0 ** np.abs(decimals)
+    with np.errstate(invalid='ignore', over='ignore'):
+        return np.where(decimals >= 0,
+                        np.round(values * scale) / scale,
+                        np.round(values / scale) * scale)
+
+
+def typed_array(values):
+    # Base64 typed array of plotly.js >= 2.28, 4 bytes per value instead of
+    # the text of the number. Older plotly.js versions don't read them.
+    values = np.asarray(values)
+    dtype = 'i4' if np.issubdtype(values.dtype, np.integer) else 'f4'
+    return {
+        'dtype': dtype,
+        'bdata': base64.b64encode(values.astype('<' + dtype).tobytes()).decode('ascii')
+    }
+
+
+def compact_array(values, typed_arrays=False):
+    # Numbers as rounded arrays (or typed arrays), anything else unchanged
+    kind = getattr(getattr(values, 'dtype', None), 'kind', None)
+    if kind == 'f':
+        values = round_significant(values)
+    elif kind in ('i', 'u'):
+        values = np.asarray(values)
+    else:
+        return values
+    return typed_array(values) if typed_arrays else values
+
+
+def compact_figure(fig, typed_arrays=False):
+    # A copy of a covid_plot figure with compact point arrays, which are
+    # shorter once encoded by Dash and smaller to keep in the figure cache
+    return dict(fig, data=[
+        dict(trace, **{
+            name: compact_array(trace[name], typed_arrays)
+            for name in ARRAY_PROPERTIES if name in trace
+        })
+        for trace in fig['data']
+    ])
+
+
+def figure_size(fig):
+    # Bytes of the figure in the JSON response of a callback, before compression
+    return len(json.dumps(fig, cls=PlotlyJSONEncoder))
+
+
+def lttb(x, y, num_points):
+    # Largest-Triangle-Three-Buckets: positions of num_points points of a line
+    # that keep its visual shape. The first and last points are always kept
+    # and every bucket in between keeps the point that forms the largest
+    # triangle with the point kept before and the average of the next bucket.
+    n = len(x)
+    if num_points >= n or num_points < 3:
+        return np.arange(n)
+    bucket_size = (n - 2) / (num_points - 2)
+    # The buckets hold a few points each, plain floats and running sums for
+    # the averages are much faster than numpy calls per bucket
+    sum_x = np.r_[0, np.cumsum(x)].tolist()
+    sum_y = np.r_[0, np.cumsum(y)].tolist()
+    x = np.asarray(x).tolist()
+    y = np.asarray(y).tolist()
+    kept = [0]
+    previous = 0
+    for i in range(num_points - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_x = (sum_x[next_end] - sum_x[end]) / (next_end - end)
+        next_y = (sum_y[next_end] - sum_y[end]) / (next_end - end)
+        previous_x = x[previous]
+        previous_y = y[previous]
+        largest_area = -1
+        for j in range(start, end):
+            area = abs((previous_x - next_x) * (y[j] - previous_y) -
+                       (previous_x - x[j]) * (next_y - previous_y))
+            if area > largest_area:
+                largest_area = area
+                previous = j
+        kept.append(previous)
+    kept.append(n - 1)
+    return np.array(kept)
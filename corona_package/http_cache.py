@@ -0,0 +1,56 @@
+import hashlib
+import time
+
+import flask
+
+
+def etag(*parts):
+    # Strong entity tag of a response that only depends on the given parts
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def enable_http_caching(server, current_version, layout_path):
+    # ETag for the layout of a Dash app, which is revalidated on every page
+    # load and answered with a 304 without building it when the browser
+    # already has the current one. The tag changes with the data version and
+    # with every start of the server, as a new release (or other settings of
+    # the app) can change the components and callbacks of the same data.
+    # With gunicorn's preload_app, all the workers share the start token.
+    # Callback responses get no tag: browsers don't revalidate the POST
+    # requests of the callbacks.
+    # Must be registered before Flask-Compress, so that it sees the encoded
+    # response and gives the gzipped one a tag of its own.
+    boot_token = '%x' % time.time_ns()
+
+    def layout_tag():
+        if flask.request.path == layout_path and flask.request.method == 'GET':
+            return etag(current_version(), boot_token, 'layout')
+        return None
+
+    @server.before_request
+    def layout_not_modified():
+        tag = layout_tag()
+        if tag is None:
+            return None
+        for candidate in [tag, tag + '-gzip']:
+            if flask.request.if_none_match.contains(candidate):
+                response = flask.Response(status=304)
+                response.set_etag(candidate)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+        return None
+
+    @server.after_request
+    def add_etag(response):
+        tag = layout_tag()
+        if tag is None or response.status_code != 200:
+            return response
+        if response.headers.get('Content-Encoding') == 'gzip':
+            tag += '-gzip'
+        response.set_etag(tag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -1,64 +1,129 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 
+from corona_package.data_store import PROCESSED_CSV_PATH, PROCESSED_DATA_DIR, build_summary, \
+    days_since_column, load_processed_store, replace_file, save_processed_data, update_summary
+
+RAW_DATA_DIR = './data/raw_data'
+# Name, size and hash of the raw files the processed data was built from
+MANIFEST_PATH = os.path.join(PROCESSED_DATA_DIR, 'manifest.json')
+# Columns that come out of aggregate_data, the rest are added by enhance_data
+BASE_COLUMNS = ['country', 'continent', 'date', 'confirmed', 'deaths', 'population']
+# Extra moving windows added by enhance_data, as
+# column: (source column, number of days, 'sum' or 'mean'),
+# e.g. 'deaths_ma14': ('daily_deaths', 14, 'mean')
+MOVING_WINDOWS = {
+    'weekly_confirmed': ('daily_confirmed', 7, 'sum'),
+    'weekly_deaths': ('daily_deaths', 7, 'sum'),
+}
+# Thresholds of the plots that count the days since a country reached them,
+# the number of days is stored for each one
+DAYS_SINCE_THRESHOLDS = [
+    ('deaths', 3),
+    ('death_rate', 0.1),
+]
+
+
+def read_report(filename):
+    # Read the columns that are used from a daily report. Older reports name
+    # the country column 'Country/Region', it is renamed to 'Country_Region'.
+    df = pd.read_csv(filename,
+                     index_col=None,
+                     header=0,
+                     usecols=lambda c: c in ['Country_Region', 'Country/Region',
+                                             'Confirmed', 'Deaths'],
+                     dtype={'Country_Region': str,
+                            'Country/Region': str,
+                            'Confirmed': 'float64',
+                            'Deaths': 'float64'})\
+        .rename(columns={'Country/Region': 'Country_Region'})
+    df['date'] = pd.Timestamp(datetime.strptime(os.path.basename(filename), '%m-%d-%Y.csv'))
+    return df
+
 
-def read_data():
-    import glob
-    path = './data/raw_data'
-    all_files = glob.glob(path + "/*.csv")
-    li = []
-    for filename in all_files:
-        df = pd.read_csv(filename, index_col=None, header=0)
-        file_date = filename[-14:-4]
-        df['date'] = file_date[-4:] + '-' + file_date[:2] + '-' + file_date[3:5]
-        li.append(df)
+def read_data(all_files=None, workers=None):
+    # The reports are parsed by a pool of processes, unless there are only a
+    # few of them (e.g. an incremental update)
+    if all_files is None:
+        all_files = glob.glob(RAW_DATA_DIR + "/*.csv")
+    workers = min(workers or os.cpu_count() or 1, len(all_files) // 8)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            li = list(executor.map(read_report, all_files, chunksize=8))
+    else:
+        li = [read_report(filename) for filename in all_files]
     return pd.concat(li, axis=0, ignore_index=True, sort=False)
 
 
+# Country names changed between versions of the reports. The patterns are
+# applied in this order, each on the result of the previous ones.
+COUNTRY_REGEX_MAPPINGS = [
+    ('^.*Azerbaijan.*$', 'Azerbaijan'),
+    ('^.*China.*$', 'China'),
+    ('^.*Korea.*$', 'South Korea'),
+    ('^.*Iran.*$', 'Iran'),
+    ('^.*Hong Kong.*$', 'Hong Kong'),
+    ('^.*Bahamas.*$', 'Bahamas'),
+    ('^.*Czechia.*$', 'Czech Republic'),
+    ('^.*Dominica.*$', 'Dominica'),
+    ('^.*Gambia.*$', 'Gambia'),
+    ('^.*Maca.*$', 'Macao'),
+    ('^.*Ireland.*$', 'Ireland'),
+    ('^.*Moldova.*$', 'Moldova'),
+    ('^.*Congo.*$', 'Congo'),
+    ('^.*Russia.*$', 'Russia'),
+    ('^.*Taiwan.*$', 'Taiwan'),
+    ('^.*UK.*$', 'United Kingdom'),
+    ('^.*US.*$', 'United States'),
+    ('^.*Viet Nam.*$', 'Vietnam'),
+    ('^.*Palesti.*$', 'State of Palestine'),
+    ('^.*Gaza.*$', 'State of Palestine'),
+    ('^.*Ivory.*$', 'Cote d\'Ivoire'),
+    ('^.*VietNam.*$', 'Vietnam'),
+    ('^.*Burma.*$', 'Myanmar'),
+    ('^.*St. Martin.*$', 'Saint Martin'),
+    ('^.*Verde*$', 'Cape Verde'),
+    ('^.*Timor-Leste*$', 'East Timor'),
+    ('^.*Jersey*$', 'United Kingdom'),
+    ('^.*Guernsey*$', 'United Kingdom'),
+    ('Channel Islands', 'United Kingdom'),
+    ('Vatican City', 'Holy See')
+]
+COUNTRY_MATCHERS = [(re.compile(pattern), name) for pattern, name in COUNTRY_REGEX_MAPPINGS]
+
+
+def normalize_country_name(name):
+    for matcher, replacement in COUNTRY_MATCHERS:
+        name = matcher.sub(replacement, name)
+    return name
+
+
+def normalize_countries(countries):
+    # Resolve each distinct raw name once and map the codes back to the rows
+    codes, uniques = pd.factorize(countries)
+    names = np.array([normalize_country_name(name) for name in uniques] + [np.nan],
+                     dtype=object)
+    # Missing names have code -1, which picks the NaN at the end
+    return pd.Series(names[codes], index=countries.index)
+
+
 def fix_version_issues(data):
-    import numpy as np
-    country_regex_mappings = {
-        '^.*Azerbaijan.*$': 'Azerbaijan',
-        '^.*China.*$': 'China',
-        '^.*Korea.*$': 'South Korea',
-        '^.*Iran.*$': 'Iran',
-        '^.*Hong Kong.*$': 'Hong Kong',
-        '^.*Bahamas.*$': 'Bahamas',
-        '^.*Czechia.*$': 'Czech Republic',
-        '^.*Dominica.*$': 'Dominica',
-        '^.*Gambia.*$': 'Gambia',
-        '^.*Maca.*$': 'Macao',
-        '^.*Ireland.*$': 'Ireland',
-        '^.*Moldova.*$': 'Moldova',
-        '^.*Congo.*$': 'Congo',
-        '^.*Russia.*$': 'Russia',
-        '^.*Taiwan.*$': 'Taiwan',
-        '^.*UK.*$': 'United Kingdom',
-        '^.*US.*$': 'United States',
-        '^.*Viet Nam.*$': 'Vietnam',
-        '^.*Palesti.*$': 'State of Palestine',
-        '^.*Gaza.*$': 'State of Palestine',
-        '^.*Ivory.*$': 'Cote d\'Ivoire',
-        '^.*VietNam.*$': 'Vietnam',
-        '^.*Burma.*$': 'Myanmar',
-        '^.*St. Martin.*$': 'Saint Martin',
-        '^.*Verde*$': 'Cape Verde',
-        '^.*Timor-Leste*$': 'East Timor',
-        '^.*Jersey*$': 'United Kingdom',
-        '^.*Guernsey*$': 'United Kingdom',
-        'Channel Islands': 'United Kingdom',
-        'Vatican City': 'Holy See'
-    }
-
-    data['date'] = pd.to_datetime(data['date'])
-    data['country'] = np.where(data.Country_Region.isna(),
-                               data['Country/Region'],
-                               data.Country_Region)
-    data['deaths'] = data.Deaths.fillna(0).map(int)
-    data['confirmed'] = data.Confirmed.fillna(0).map(int)
+    data['country'] = data.Country_Region
+    data['deaths'] = data.Deaths.fillna(0).astype('int64')
+    data['confirmed'] = data.Confirmed.fillna(0).astype('int64')
     data_ = data[['date', 'country', 'confirmed', 'deaths']] \
         .sort_values(['country', 'date']) \
         .reset_index(drop=True)
-    data_ = data_.replace(regex=country_regex_mappings)
+    data_['country'] = normalize_countries(data_.country)
     return data_
 
 
@@ -104,28 +169,214 @@ def aggregate_data(data):
     return agg_data
 
 
-def enhance_data(data, moving_period=7):
-    data['daily_deaths'] = data.groupby('country')\
-        .deaths.apply(lambda x: x - x.shift(1))\
-        .fillna(0)\
-        .map(int)
-    data['daily_confirmed'] = data.groupby('country') \
-        .confirmed.apply(lambda x: x - x.shift(1)) \
-        .fillna(0) \
-        .map(int)
-    data['flat_ma'] = data.groupby('country').daily_deaths\
-        .rolling(moving_period)\
-        .mean()\
-        .reset_index(0, drop=True)
+def group_positions(keys):
+    # For data sorted by the keys, whether each row starts a new group and
+    # its position within the group
+    starts = np.r_[True, keys[1:] != keys[:-1]] if len(keys) else np.zeros(0, dtype=bool)
+    rows = np.arange(len(keys))
+    group_first_rows = np.maximum.accumulate(np.where(starts, rows, 0))
+    return starts, rows - group_first_rows
+
+
+def grouped_diff(values, starts):
+    # Difference with the previous row, 0 on the first row of every group
+    diff = np.diff(values, prepend=values[:1])
+    diff[starts] = 0
+    return diff
+
+
+def grouped_rolling_sum(cumsum, positions, window):
+    # Sum of the last `window` rows from the cumulative sum of the values,
+    # NaN until a group has `window` rows (like rolling(window).sum())
+    sums = np.full(len(positions), np.nan)
+    sums[window - 1:] = cumsum[window:] - cumsum[:len(cumsum) - window]
+    sums[positions < window - 1] = np.nan
+    return sums
+
+
+def enhance_data(data, moving_period=7, moving_windows=None):
+    # The diffs and moving windows are computed in one pass over the data
+    # sorted by country and date, with the group boundaries as the only
+    # per-country information
+    if moving_windows is None:
+        moving_windows = MOVING_WINDOWS
+    data = data.sort_values(['country', 'date'], kind='mergesort')
+    starts, positions = group_positions(data.country.values)
+    data['daily_deaths'] = grouped_diff(data.deaths.values.astype(np.int64), starts)
+    data['daily_confirmed'] = grouped_diff(data.confirmed.values.astype(np.int64), starts)
+
+    windows = dict(moving_windows, flat_ma=('daily_deaths', moving_period, 'mean'))
+    cumsums = {}
+    for column, (source, window, how) in windows.items():
+        if source not in cumsums:
+            cumsums[source] = np.r_[0, np.cumsum(data[source].values)]
+        values = grouped_rolling_sum(cumsums[source], positions, window)
+        data[column] = values / window if how == 'mean' else values
     data['death_rate'] = data.deaths / data.population * 1000000
+    return add_days_since(data, starts, positions)
+
+
+def add_days_since(data, starts=None, positions=None):
+    # Number of rows of the country so far that reached the threshold, minus
+    # one, i.e. the cumcount of the rows that pass the threshold filter of
+    # the plots, and -1 for the rows that don't pass it
+    if starts is None:
+        starts, positions = group_positions(data.country.values)
+    group_first_rows = np.arange(len(data)) - positions
+    for column, threshold in DAYS_SINCE_THRESHOLDS:
+        reached = (data[column].values >= threshold).astype(np.int64)
+        counts = np.cumsum(reached)
+        counts_before_group = (counts - reached)[group_first_rows]
+        data[days_since_column(column, threshold)] = np.where(
+            reached == 1, counts - counts_before_group - 1, -1)
+    return data
+
+
+def max_window(moving_period=7, moving_windows=None):
+    # Rows of context enhance_data needs before the first row it recomputes
+    if moving_windows is None:
+        moving_windows = MOVING_WINDOWS
+    return max([moving_period] + [window for _, window, _ in moving_windows.values()])
+
+
+def raw_files_manifest(previous_manifest):
+    # The hash is only computed again for files whose size or mtime changed
+    manifest = {}
+    for filename in sorted(glob.glob(RAW_DATA_DIR + "/*.csv")):
+        name = os.path.basename(filename)
+        stat = os.stat(filename)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        previous = previous_manifest.get(name, {})
+        if all(previous.get(k) == v for k, v in entry.items()):
+            entry['sha1'] = previous['sha1']
+        else:
+            with open(filename, 'rb') as f:
+                entry['sha1'] = hashlib.sha1(f.read()).hexdigest()
+        manifest[name] = entry
+    return manifest
+
+
+def pipeline_settings():
+    # Settings that change the derived columns. The stored data can only be
+    # updated incrementally if it was built with the same ones.
+    return json.loads(json.dumps({'moving_windows': MOVING_WINDOWS,
+                                  'days_since_thresholds': DAYS_SINCE_THRESHOLDS}))
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('settings') != pipeline_settings():
+        print('The pipeline settings changed, reprocessing all the raw files')
+        return None
+    return manifest['files']
+
+
+def save_manifest(manifest):
+    replace_file(MANIFEST_PATH,
+                 lambda f: json.dump({'settings': pipeline_settings(), 'files': manifest},
+                                     f, indent=1, sort_keys=True),
+                 mode='w')
+
+
+def report_date(name):
+    return pd.to_datetime(name[:-4], format='%m-%d-%Y')
+
+
+def update_data(processed_data, new_data, changed_dates, context_rows=None):
+    # Replace the rows of the changed dates with the newly aggregated ones and
+    # run enhance_data on the tail that is affected. For every country that
+    # is the rows from the first changed date on, plus context_rows earlier
+    # rows for the diffs and moving averages (at least the longest window).
+    processed_data = processed_data.copy()
+    for column in ['country', 'continent']:
+        processed_data[column] = processed_data[column].astype(str)
+    data = pd.concat([processed_data[~processed_data.date.isin(changed_dates)]] +
+                     ([new_data] if new_data is not None else []),
+                     axis=0, ignore_index=True, sort=False)\
+        .sort_values(['country', 'date'])\
+        .reset_index(drop=True)
+
+    if context_rows is None:
+        context_rows = max_window()
+    first_changed_date = min(changed_dates)
+    position = data.groupby('country').cumcount()
+    first_changed_position = position.where(data.date >= first_changed_date)\
+        .groupby(data.country)\
+        .transform('min')
+    tail = data[position >= first_changed_position - context_rows]
+    enhanced = enhance_data(data=tail[BASE_COLUMNS].copy())
+
+    changed_rows = enhanced.index[enhanced.date >= first_changed_date]
+    derived_columns = [c for c in enhanced.columns if c not in BASE_COLUMNS]
+    for column in derived_columns:
+        data.loc[changed_rows, column] = enhanced.loc[changed_rows, column]
+        data[column] = data[column].astype(enhanced[column].dtype)
+    # The days since a threshold depend on the whole history of a country,
+    # they are counted again for the countries with changed rows only
+    changed_countries = data.country[data.date >= first_changed_date].unique()
+    rows = data.country.isin(changed_countries).values
+    counted = add_days_since(data[rows].copy())
+    for column, threshold in DAYS_SINCE_THRESHOLDS:
+        name = days_since_column(column, threshold)
+        data.loc[rows, name] = counted[name].values
     return data
 
 
 if __name__ == '__main__':
-    raw_data = read_data()
-    fixed_data = fix_version_issues(data=raw_data)
-    agg_data = aggregate_data(data=fixed_data)
-    data = enhance_data(data=agg_data)
-    data.to_csv('./data/processed_data.csv', index=False)
-    print('Processed data until:', agg_data.date.dt.date.max())
+    parser = argparse.ArgumentParser(description='Prepare the data of the dashboard.')
+    parser.add_argument('--full', action='store_true',
+                        help='reprocess all the raw files instead of only the new or changed ones')
+    parser.add_argument('--csv', action='store_true',
+                        help='also write the processed data to ' + PROCESSED_CSV_PATH +
+                             ', the app reads the binary store in ' + PROCESSED_DATA_DIR)
+    args = parser.parse_args()
+
+    previous_manifest = None if args.full else load_manifest()
+    manifest = raw_files_manifest(previous_manifest or {})
+
+    if previous_manifest is None:
+        raw_data = read_data()
+        fixed_data = fix_version_issues(data=raw_data)
+        agg_data = aggregate_data(data=fixed_data)
+        data = enhance_data(data=agg_data)
+        summary_df = None
+    else:
+        changed_files = [name for name, entry in manifest.items()
+                         if previous_manifest.get(name, {}).get('sha1') != entry['sha1']]
+        removed_files = [name for name in previous_manifest if name not in manifest]
+        if not changed_files and not removed_files:
+            print('Processed data is up to date')
+            raise SystemExit
+        print('Reprocessing', len(changed_files), 'new or changed and',
+              len(removed_files), 'removed raw files')
+        agg_data = None
+        if changed_files:
+            raw_data = read_data([os.path.join(RAW_DATA_DIR, name) for name in changed_files])
+            agg_data = aggregate_data(data=fix_version_issues(data=raw_data))
+        processed_data, summary_df = load_processed_store()
+        changed_dates = [report_date(name) for name in changed_files + removed_files]
+        data = update_data(
+            processed_data=processed_data,
+            new_data=agg_data,
+            changed_dates=changed_dates)
+        # The stored summary can be updated with the new days only if they
+        # all come after the processed ones
+        if removed_files or min(changed_dates) <= processed_data.date.max():
+            summary_df = None
 
+    data['population'] = data.population.fillna(0).astype('int64')
+    if summary_df is None:
+        summary_df = build_summary(data)
+    else:
+        summary_df = update_summary(summary_df, data[data.date.isin(changed_dates)])
+    # Store the rows sorted, so that the app can index them without a copy
+    data = data.sort_values(['country', 'date']).reset_index(drop=True)
+    if args.csv:
+        data.to_csv(PROCESSED_CSV_PATH, index=False)
+    save_processed_data(data, summary_df=summary_df)
+    save_manifest(manifest)
+    print('Processed data until:', data.date.dt.date.max())
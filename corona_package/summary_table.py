@@ -0,0 +1,148 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Stops of the population slider of the table
+SLIDER_STOPS = [0, .25, .5, .75, 1]
+
+
+class SummaryTable:
+    # Filters the summary of the dash table without building intermediate
+    # frames. Everything that only depends on the summary (population
+    # quantiles, masks, sort orders, records) is computed once per data
+    # version, and every call composes its filters as one boolean mask.
+    def __init__(self, records):
+        # records are the rows of the summary, sorted by total cases, as
+        # stored by prepare_data.py
+        self.records = records
+        self.names = np.array([r['Country / Continent'] for r in records], dtype=str)
+        self.continents = np.array([r['Continent'] for r in records], dtype=str)
+        self.population = np.array([r['Population'] for r in records], dtype=np.int64)
+        self.is_world = self.names == 'World'
+        self.is_continent = np.isin(self.names, np.unique(self.continents))
+        # The lower bound of the slider is a quantile of the countries and the
+        # upper one of the countries and continents, as the world and the
+        # continents would otherwise always be at the top
+        self.from_population = np.sort(
+            self.population[~self.is_continent & (self.population > 0)])
+        self.to_population = np.sort(
+            self.population[~self.is_world & (self.population > 0)])
+        self.from_quantiles = {q: self.quantile(self.from_population, q) for q in SLIDER_STOPS}
+        self.to_quantiles = {q: self.quantile(self.to_population, q) for q in SLIDER_STOPS}
+        # Positions of the rows sorted by every column in both directions,
+        # so that sorting a page is an indexing
+        self.orders = {
+            (column, ascending): self.sort_order(column, ascending)
+            for column in (records[0] if records else {})
+            for ascending in [True, False]
+        }
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    @staticmethod
+    def quantile(sorted_values, q):
+        # Same linear interpolation as pandas' Series.quantile
+        if len(sorted_values) == 0:
+            return np.nan
+        return np.quantile(sorted_values, q)
+
+    def sort_order(self, column, ascending):
+        # Stable order of the rows by a column, missing values last
+        values = [r[column] for r in self.records]
+        missing = [v is None or v != v for v in values]
+        present = sorted((i for i, m in enumerate(missing) if not m),
+                         key=values.__getitem__, reverse=not ascending)
+        return np.array(present + [i for i, m in enumerate(missing) if m], dtype=np.int64)
+
+    def population_range(self, slider_values):
+        from_q, to_q = slider_values
+        if from_q not in self.from_quantiles:
+            self.from_quantiles[from_q] = self.quantile(self.from_population, from_q)
+        if to_q not in self.to_quantiles:
+            self.to_quantiles[to_q] = self.quantile(self.to_population, to_q)
+        return self.from_quantiles[from_q], self.to_quantiles[to_q]
+
+    def mask(self, country_value, reference_values, slider_values,
+             checkbox_values, countries_only):
+        # Rows that pass all the filters of the table. The world is always
+        # kept by the population filter.
+        from_population, to_population = self.population_range(slider_values)
+        mask = ((self.population >= from_population) &
+                (self.population <= to_population)) | self.is_world
+
+        if (country_value is None or len(country_value) < 1) and \
+                (reference_values is None or len(reference_values) < 1):
+            pass
+        elif reference_values is None:
+            mask &= self.names == country_value
+        elif country_value is None:
+            mask &= np.isin(self.names, reference_values)
+        else:
+            mask &= np.isin(self.names, [country_value] + reference_values)
+
+        mask &= np.isin(self.continents, checkbox_values + ['World'])
+        if countries_only == 2:
+            mask &= ~self.is_continent
+        elif countries_only == 3:
+            mask &= self.is_continent
+        return mask
+
+    def rows(self, country_value, reference_values, slider_values,
+             checkbox_values, countries_only, sort_by=None):
+        # Positions of the rows to show, in display order
+        mask = self.mask(country_value, reference_values, slider_values,
+                         checkbox_values, countries_only)
+        if sort_by:
+            order = self.orders[sort_by[0]['column_id'], sort_by[0]['direction'] == 'asc']
+            return order[mask[order]]
+        return np.flatnonzero(mask)
+
+    def page(self, page_current, page_size, *args, **kwargs):
+        # Records of one page of the rows to show and the number of pages.
+        # The ranks are the positions among all the rows to show. A page
+        # past the end (e.g. after a filter removed rows) gives the last one.
+        start = time.perf_counter()
+        rows = self.rows(*args, **kwargs)
+        page_count = max(1, math.ceil(len(rows) / page_size))
+        first = min(page_current or 0, page_count - 1) * page_size
+        records = [dict(self.records[i], Rank=rank)
+                   for rank, i in enumerate(rows[first:first + page_size], start=first + 1)]
+        self.record_time(time.perf_counter() - start)
+        return records, page_count
+
+    def client_data(self):
+        # The summary by column, with the population of the slider stops, for
+        # the clientside version of page in assets/summary_table.js
+        return {
+            'columns': {
+                column: [r[column] for r in self.records]
+                for column in (self.records[0] if self.records else {})
+            },
+            'stops': SLIDER_STOPS,
+            # Plain floats, numpy scalars are encoded by the slow path of
+            # plotly's JSON encoder
+            'from_quantiles': [float(self.from_quantiles[q]) for q in SLIDER_STOPS],
+            'to_quantiles': [float(self.to_quantiles[q]) for q in SLIDER_STOPS]
+        }
+
+    def record_time(self, elapsed):
+        with self.lock:
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        logger.debug('Filtered the summary table in %.2f ms', elapsed * 1000)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'mean_ms': self.total_time / self.calls * 1000 if self.calls else 0,
+                'max_ms': self.max_time * 1000
+            }
@@ -0,0 +1,109 @@
+# Gunicorn settings for the Procfile.
+import os
+import signal
+import sys
+import threading
+import time
+
+# Load the app, and with when_ready the processed data, once in the master
+# process before forking the workers. The workers then share the pages of the data instead
+# of each loading its own copy.
+preload_app = True
+
+
+def when_ready(server):
+    # The app only loads what its layout needs at import. With preload_app,
+    # build the index of the countries and the default view (its figures and
+    # the pre-rendered layout) in the master too, before the workers are
+    # forked, so that they share them instead of each building its own and
+    # the first visitors of a new worker don't wait for them. The figures of
+    # the top countries are left to the warm-up of every worker, started by
+    # post_worker_init, which finds them in the disk cache once one worker
+    # built them.
+    # New data versions are loaded by the master too, see on_reload, so the
+    # workers don't poll for them.
+    # No worker runs yet, so the figures the disk cache kept from earlier
+    # runs, of other data versions or of other code, can be removed.
+    app = sys.modules.get('app')
+    if app is not None:
+        app.disk_cache.prune(app.data_store.snapshot.version)
+        warm_up_default_view(server, app)
+        app.data_store.follow_changes = False
+        thread = threading.Thread(target=watch_data, args=(app.data_store,),
+                                  name='data-store-watcher')
+        thread.daemon = True
+        thread.start()
+
+
+def warm_up_default_view(server, app):
+    try:
+        snapshot = app.data_store.snapshot
+        snapshot.country_index
+        app.warm_up_default_view(snapshot)
+    except Exception:
+        # The workers build them on their own
+        server.log.exception('Could not warm up the default view')
+
+
+def watch_data(data_store):
+    # Polls the processed data in the master and sends it a HUP for every new
+    # version. Gunicorn then calls on_reload and replaces the workers with
+    # new ones forked from the reloaded master. Each version is only
+    # signaled once, a failed reload waits for the next version.
+    signaled_version = None
+    while data_store.poll_interval:
+        time.sleep(data_store.poll_interval)
+        try:
+            version = data_store.version()
+        except (OSError, ValueError):
+            # e.g. prepare_data.py is still writing, retry on next poll
+            continue
+        if version != data_store.snapshot.version and version != signaled_version:
+            signaled_version = version
+            os.kill(os.getpid(), signal.SIGHUP)
+
+
+def on_reload(server):
+    # Load the new version, its country index and its default view before
+    # the new workers are forked, so that they share them like the first
+    # ones did. The old workers keep serving the previous version until they
+    # are replaced.
+    app = sys.modules.get('app')
+    if app is None:
+        return
+    try:
+        reloaded = app.data_store.reload_if_changed(warm_up=False)
+    except Exception:
+        server.log.exception('Could not reload the processed data')
+        return
+    if reloaded:
+        warm_up_default_view(server, app)
+
+
+def memory_usage():
+    # Resident and proportional set size of this process in kB. The PSS
+    # divides the shared pages between the processes that use them, so it is
+    # the actual cost of a worker.
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('Rss', 'Pss'):
+                    usage[name.lower()] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def post_worker_init(worker):
+    usage = memory_usage()
+    if usage:
+        worker.log.info('Worker %s memory: rss=%d kB pss=%d kB',
+                        worker.pid, usage['rss'], usage['pss'])
+    # Warm up the figures of the top countries in the background as soon as
+    # the worker starts, rather than on its first request. The watcher thread
+    # doesn't survive the fork, so every worker starts its own.
+    app = sys.modules.get('app')
+    if app is not None:
+        app.data_store.start_watching()
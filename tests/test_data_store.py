@@ -0,0 +1,42 @@
+import json
+
+import pandas as pd
+
+from corona_package.data_store import SUMMARY_COLUMNS, build_summary, listed_countries, \
+    update_summary
+
+
+def report(days, deaths):
+    return pd.DataFrame({
+        'country': pd.Categorical(['Holy See', 'Italy'] * len(days)),
+        'continent': pd.Categorical(['Europe', 'Europe'] * len(days)),
+        'date': pd.to_datetime([day for day in days for _ in range(2)]),
+        'confirmed': [5, 100] * len(days),
+        'deaths': [d for death in deaths for d in (death, 10)],
+        'population': [800, 60000000] * len(days)
+    })
+
+
+def test_update_summary_matches_build_summary():
+    # update_summary, used by the incremental runs of prepare_data, gives the
+    # same summary as build_summary over all the days, starting from a
+    # summary stored as JSON records like save_processed_data does. The Holy
+    # See gets its first death in the new days.
+    old_days = report(['2020-03-01', '2020-03-02'], [0, 0])
+    new_days = report(['2020-03-03'], [1])
+    records = json.loads(json.dumps(build_summary(old_days).to_dict('records')))
+    stored = pd.DataFrame(records, columns=SUMMARY_COLUMNS)
+
+    updated = update_summary(stored, new_days)
+    expected = build_summary(pd.concat([old_days, new_days], ignore_index=True))
+    pd.testing.assert_frame_equal(updated, expected)
+
+
+def test_listed_countries():
+    # The countries come first, then the world and the continents, like in
+    # the aggregated data, even though the processed data is sorted by name
+    data = pd.DataFrame({
+        'country': pd.Categorical(['Afghanistan', 'Africa', 'Algeria', 'Asia', 'World', 'Zambia']),
+        'continent': pd.Categorical(['Asia', 'Africa', 'Africa', 'Asia', 'World', 'Africa'])
+    })
+    assert listed_countries(data) == ['Afghanistan', 'Algeria', 'Zambia', 'World', 'Africa', 'Asia']
@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+
+from corona_package.disk_cache import DiskCache, code_token
+
+
+def test_payloads_of_other_code_are_not_found(tmp_path):
+    key = ('flat_deaths', 'World', None, 3, 'v1')
+    DiskCache(str(tmp_path), token='old').set(key, 'v1', {'title': 'old'})
+    cache = DiskCache(str(tmp_path), token='new')
+    assert cache.load(key, 'v1') == (None, 0)
+
+    cache.set(key, 'v1', {'title': 'new'})
+    cache.prune('v1')
+    assert os.listdir(str(tmp_path)) == ['v1-new']
+    assert cache.load(key, 'v1')[0] == {'title': 'new'}
+
+
+def test_code_token(tmp_path):
+    source = tmp_path / 'plot.py'
+    source.write_text('TITLE = 1\n')
+    token = code_token([str(source)], 'setting')
+    assert code_token([str(source)], 'setting') == token
+    assert code_token([str(source)], 'other setting') != token
+    source.write_text('TITLE = 2\n')
+    assert code_token([str(source)], 'setting') != token
+
+
+def test_a_payload_is_built_by_one_process(tmp_path):
+    key = ('flat_deaths', 'World', None, 3, 'v1')
+    cache = DiskCache(str(tmp_path))
+    assert cache.claim(key, 'v1')
+    assert not cache.claim(key, 'v1')
+
+    def build():
+        time.sleep(0.2)
+        cache.set(key, 'v1', {'title': 'built'})
+        cache.release(key, 'v1')
+    thread = threading.Thread(target=build)
+    thread.start()
+    assert cache.wait(key, 'v1')[0] == {'title': 'built'}
+    thread.join()
+    assert cache.claim(key, 'v1')
+
+
+def test_locks_of_dead_processes_are_taken_over(tmp_path):
+    key = ('flat_deaths', 'World', None, 3, 'v1')
+    cache = DiskCache(str(tmp_path), lock_timeout=60)
+    assert cache.claim(key, 'v1')
+    lock_path = cache.path(key, 'v1') + '.lock'
+    os.utime(lock_path, (time.time() - 120, time.time() - 120))
+    assert cache.wait(key, 'v1') == (None, 0)
+    assert cache.claim(key, 'v1')
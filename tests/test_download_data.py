@@ -0,0 +1,52 @@
+import functools
+import http.server
+import os
+import threading
+from datetime import date
+
+import pytest
+
+from corona_package.download_data import download_data
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def reports_server(tmp_path):
+    # Serves the reports of March 1st and 2nd, with Last-Modified and
+    # answering If-Modified-Since with a 304, the report of March 3rd is
+    # not published yet
+    served = tmp_path / 'served'
+    served.mkdir()
+    for name in ['03-01-2020.csv', '03-02-2020.csv']:
+        (served / name).write_text('Country_Region,Confirmed,Deaths\nItaly,1,0\n')
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(served)))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d/' % server.server_address[1], served
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_data(reports_server, tmp_path):
+    base_url, served = reports_server
+    directory = str(tmp_path / 'raw_data')
+    days = [date(2020, 3, 1), date(2020, 3, 2), date(2020, 3, 3)]
+
+    def download(refresh_days):
+        return download_data(days[0], date(2020, 3, 4), base_url=base_url,
+                             directory=directory, workers=2, refresh_days=refresh_days)
+
+    assert download(refresh_days=3) == dict(zip(days, ['downloaded', 'downloaded', 'missing']))
+    assert sorted(os.listdir(directory)) == ['.validators.json', '03-01-2020.csv', '03-02-2020.csv']
+    assert (tmp_path / 'raw_data' / '03-01-2020.csv').read_text() == \
+        (served / '03-01-2020.csv').read_text()
+
+    # The reports of the last days are revalidated, the older ones skipped
+    assert download(refresh_days=3) == dict(zip(days, ['not_modified', 'not_modified', 'missing']))
+    assert download(refresh_days=2) == dict(zip(days, ['skipped', 'not_modified', 'missing']))
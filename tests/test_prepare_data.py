@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from corona_package.prepare_data import BASE_COLUMNS, COUNTRY_REGEX_MAPPINGS, enhance_data, \
+    normalize_countries, normalize_country_name, update_data
+
+
+def aggregated(days, seed=0):
+    # Aggregated data like aggregate_data gives, with a country that only
+    # starts to report later and reaches the thresholds of the plots
+    rng = np.random.default_rng(seed)
+    frames = []
+    for country, continent, population, first_day in [
+            ('Italy', 'Europe', 60000000, 0),
+            ('Sweden', 'Europe', 10000000, 5),
+            ('Europe', 'Europe', 70000000, 0)]:
+        dates = pd.date_range('2020-03-01', periods=days)[first_day:]
+        confirmed = np.cumsum(rng.integers(0, 500, len(dates)))
+        frames.append(pd.DataFrame({
+            'country': country,
+            'continent': continent,
+            'date': dates,
+            'confirmed': confirmed,
+            'deaths': confirmed // 20,
+            'population': population
+        }))
+    return pd.concat(frames, ignore_index=True)[BASE_COLUMNS]
+
+
+def sorted_rows(data):
+    return data.sort_values(['country', 'date']).reset_index(drop=True)
+
+
+def assert_same_as_full(updated, all_days):
+    expected = sorted_rows(enhance_data(all_days.copy()))
+    pd.testing.assert_frame_equal(sorted_rows(updated)[expected.columns], expected)
+
+
+@pytest.mark.parametrize('changed_days, stored_before', [
+    # Appended days
+    ([27, 28, 29], False),
+    # Corrected totals of a day in the middle and of the last one
+    ([12, 29], True),
+])
+def test_update_data_matches_enhance_data(changed_days, stored_before):
+    all_days = aggregated(30)
+    changed_dates = list(pd.date_range('2020-03-01', periods=30)[changed_days])
+    old_days = all_days[~all_days.date.isin(changed_dates)]
+    if stored_before:
+        # Other totals of the changed days were processed before
+        previous_totals = aggregated(30, seed=1)
+        old_days = pd.concat([old_days, previous_totals[previous_totals.date.isin(changed_dates)]])
+    processed = enhance_data(old_days.copy())
+
+    updated = update_data(processed, all_days[all_days.date.isin(changed_dates)],
+                          changed_dates)
+    assert_same_as_full(updated, all_days)
+
+
+def test_update_data_with_removed_days():
+    all_days = aggregated(30)
+    removed_dates = list(pd.date_range('2020-03-01', periods=30)[[10, 29]])
+    processed = enhance_data(all_days.copy())
+
+    updated = update_data(processed, None, removed_dates)
+    assert_same_as_full(updated, all_days[~all_days.date.isin(removed_dates)])
+
+
+@pytest.mark.parametrize('raw_name, name', [
+    ('Mainland China', 'China'),
+    ('Korea, South', 'South Korea'),
+    ('Republic of Korea', 'South Korea'),
+    ('Iran (Islamic Republic of)', 'Iran'),
+    ('Hong Kong SAR', 'Hong Kong'),
+    ('Bahamas, The', 'Bahamas'),
+    ('Czechia', 'Czech Republic'),
+    ('Dominican Republic', 'Dominica'),
+    ('Macao SAR', 'Macao'),
+    ('Republic of Ireland', 'Ireland'),
+    ('Congo (Kinshasa)', 'Congo'),
+    ('Russian Federation', 'Russia'),
+    ('Taiwan*', 'Taiwan'),
+    ('UK', 'United Kingdom'),
+    ('US', 'United States'),
+    ('Viet Nam', 'Vietnam'),
+    ('occupied Palestinian territory', 'State of Palestine'),
+    ('West Bank and Gaza', 'State of Palestine'),
+    ('Ivory Coast', 'Cote d\'Ivoire'),
+    ('Burma', 'Myanmar'),
+    ('St. Martin', 'Saint Martin'),
+    ('Cabo Verde', 'Cape Verde'),
+    ('Timor-Leste', 'East Timor'),
+    ('Jersey', 'United Kingdom'),
+    ('Channel Islands', 'United Kingdom'),
+    ('Vatican City', 'Holy See'),
+    ('Italy', 'Italy'),
+])
+def test_normalize_country_name(raw_name, name):
+    assert normalize_country_name(raw_name) == name
+
+
+def test_normalize_countries_matches_the_mapping_table():
+    # The names are resolved once per distinct name, the rows (including
+    # missing names) get the same names as a replace of every row with the
+    # mapping table
+    countries = pd.Series(['US', 'Mainland China', None, 'US', 'Italy', 'Vatican City'],
+                          index=[3, 1, 4, 0, 2, 5])
+    expected = countries.replace(regex=dict(COUNTRY_REGEX_MAPPINGS))
+    pd.testing.assert_series_equal(normalize_countries(countries), expected)